@@ -0,0 +1,158 @@
+# admission.py
+
+import os
+import math
+import time
+import heapq
+import itertools
+import threading
+from contextlib import contextmanager
+from metrics import Counter, Gauge
+
+# Waiting requests are admitted in priority order: interactive requests before background jobs
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 1
+PRIORITY_BACKGROUND = 2
+
+# Concurrent holders per resource
+RESOURCE_LIMITS = {
+    'ytdlp': int(os.environ.get('LIMIT_YTDLP', 4)),
+    'ffmpeg': int(os.environ.get('LIMIT_FFMPEG', os.cpu_count() or 2)),
+    'gcs': int(os.environ.get('LIMIT_GCS', 8)),
+    'speech': int(os.environ.get('LIMIT_SPEECH', 8)),
+    'dify': int(os.environ.get('LIMIT_DIFY', 8)),
+}
+# Callers allowed to wait for each resource before new ones are turned away
+ADMISSION_QUEUE_SIZE = int(os.environ.get('ADMISSION_QUEUE_SIZE', 32))
+# Seconds an interactive request waits for a slot; background jobs have no client waiting on them
+ADMISSION_TIMEOUT = float(os.environ.get('ADMISSION_TIMEOUT', 30))
+ADMISSION_BACKGROUND_TIMEOUT = float(os.environ.get('ADMISSION_BACKGROUND_TIMEOUT', 15 * 60))
+
+admission_in_use = Gauge('admission_in_use', 'Slots held per resource', ['resource'])
+admission_waiting = Gauge('admission_waiting', 'Callers waiting per resource', ['resource'])
+admission_rejected = Counter('admission_rejected_total', 'Callers turned away per resource', ['resource', 'reason'])
+
+_local = threading.local()
+
+
+class Overloaded(Exception):
+    """Raised when a resource has no free slot and no room to wait for one."""
+
+    def __init__(self, resource, retry_after):
+        super().__init__(f"{resource} is overloaded, retry in {retry_after} s")
+        self.resource = resource
+        self.retry_after = retry_after
+
+
+def current_priority():
+    return getattr(_local, 'priority', PRIORITY_INTERACTIVE)
+
+
+@contextmanager
+def priority(level):
+    """Run the block (and the resources it acquires) at the given priority."""
+    previous = current_priority()
+    _local.priority = level
+    try:
+        yield
+    finally:
+        _local.priority = previous
+
+
+def admission_timeout(level=None):
+    """Seconds a caller at this priority may wait on a resource."""
+    level = current_priority() if level is None else level
+    return ADMISSION_BACKGROUND_TIMEOUT if level >= PRIORITY_BACKGROUND else ADMISSION_TIMEOUT
+
+
+class ResourceLimiter:
+    """Concurrency limit with a bounded wait queue ordered by priority, then arrival."""
+
+    def __init__(self, name, limit, max_waiting=ADMISSION_QUEUE_SIZE):
+        self.name = name
+        self.limit = limit
+        self.max_waiting = max_waiting
+        self._in_use = 0
+        self._waiters = []  # heap of (priority, sequence)
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        # Moving average of how long a slot is held, used for Retry-After
+        self._average_hold = 1.0
+
+    def retry_after(self):
+        """Seconds until a slot is likely to be free, for the Retry-After header."""
+        queued = len(self._waiters) + 1
+        return max(1, math.ceil(self._average_hold * queued / self.limit))
+
+    def acquire(self, level=None, timeout=None):
+        level = current_priority() if level is None else level
+        if timeout is None:
+            timeout = admission_timeout(level)
+        with self._condition:
+            if self._in_use < self.limit and not self._waiters:
+                self._in_use += 1
+                admission_in_use.set(self._in_use, resource=self.name)
+                return
+            if len(self._waiters) >= self.max_waiting:
+                admission_rejected.inc(resource=self.name, reason='queue_full')
+                raise Overloaded(self.name, self.retry_after())
+
+            entry = (level, next(self._sequence))
+            heapq.heappush(self._waiters, entry)
+            admission_waiting.set(len(self._waiters), resource=self.name)
+            deadline = time.monotonic() + timeout
+            try:
+                while not (self._in_use < self.limit and self._waiters[0] == entry):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        admission_rejected.inc(resource=self.name, reason='timeout')
+                        raise Overloaded(self.name, self.retry_after())
+                    self._condition.wait(remaining)
+                self._in_use += 1
+                admission_in_use.set(self._in_use, resource=self.name)
+            finally:
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+                admission_waiting.set(len(self._waiters), resource=self.name)
+                # The head of the queue may have changed, so let the others re-check
+                self._condition.notify_all()
+
+    def release(self, held_seconds=None):
+        with self._condition:
+            self._in_use -= 1
+            admission_in_use.set(self._in_use, resource=self.name)
+            if held_seconds is not None:
+                self._average_hold = 0.8 * self._average_hold + 0.2 * held_seconds
+            self._condition.notify_all()
+
+    @contextmanager
+    def slot(self, level=None, timeout=None):
+        self.acquire(level, timeout)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - started)
+
+
+limiters = {name: ResourceLimiter(name, limit) for name, limit in RESOURCE_LIMITS.items()}
+
+
+@contextmanager
+def admit(*resources):
+    """Hold one slot of each resource for the duration of the block.
+
+    Resources are always taken in RESOURCE_LIMITS order so two callers can never
+    each hold what the other is waiting for.
+    """
+    ordered = sorted(resources, key=list(RESOURCE_LIMITS).index)
+    held = []
+    try:
+        for name in ordered:
+            limiter = limiters[name]
+            limiter.acquire()
+            held.append((limiter, time.monotonic()))
+        yield
+    finally:
+        for limiter, started in reversed(held):
+            limiter.release(time.monotonic() - started)
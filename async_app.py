@@ -0,0 +1,333 @@
+# async_app.py
+"""Async serving mode (SERVING_MODE=async).
+
+/video-metadata, /video-transcript and /create-document are served as coroutines on one
+shared aiohttp connection pool and the async Firestore client, so a single process can
+keep hundreds of them in flight. Every other route falls through to the Flask app, which
+runs on its own thread pool so yt-dlp, ffmpeg and Speech work never blocks the event loop
+or the threads the native routes rely on.
+"""
+
+import os
+import json
+import time
+import random
+import asyncio
+import logging
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from aiohttp import web, ClientSession, ClientTimeout, ClientConnectorError, TCPConnector
+from werkzeug.http import http_date
+from werkzeug.test import EnvironBuilder, run_wsgi_app
+import db
+from utils import load_api_key
+from cache import get_cache
+from clients import HTTP_POOL_SIZE, get_async_firestore_client
+from metrics import timed, request_duration
+from admission import Overloaded, PRIORITY_INTERACTIVE, admission_timeout, limiters
+from youtube_utils import get_video_id, get_youtube_transcript, _parse_video_metadata
+from singleflight import AsyncSingleFlight
+
+logger = logging.getLogger(__name__)
+
+# Threads for short blocking work of the native routes: caption fetches, cache I/O and limiter waits
+ASYNC_BLOCKING_WORKERS = int(os.environ.get('ASYNC_BLOCKING_WORKERS', 32))
+blocking_executor = ThreadPoolExecutor(max_workers=ASYNC_BLOCKING_WORKERS, thread_name_prefix='async-blocking')
+# Threads for the Flask fallback, whose requests can run audio pipelines for minutes
+ASYNC_FALLBACK_WORKERS = int(os.environ.get('ASYNC_FALLBACK_WORKERS', 32))
+fallback_executor = ThreadPoolExecutor(max_workers=ASYNC_FALLBACK_WORKERS, thread_name_prefix='async-fallback')
+
+# Identical documents submitted at the same time are indexed once
+document_flight = AsyncSingleFlight()
+
+# Routes served as coroutines; everything else goes to the Flask app
+NATIVE_ROUTES = ('/video-metadata', '/video-transcript', '/create-document')
+# Hop-by-hop headers are set by aiohttp itself
+HOP_BY_HOP_HEADERS = {'connection', 'keep-alive', 'transfer-encoding'}
+
+
+def _json_default(value):
+    # Same rendering of datetimes as Flask's JSON provider
+    if hasattr(value, 'timetuple'):
+        return http_date(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def json_response(data, status=200, headers=None):
+    return web.json_response(
+        data, status=status, headers=headers, dumps=functools.partial(json.dumps, default=_json_default)
+    )
+
+
+async def run_blocking(func, *args, executor=blocking_executor):
+    return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+
+
+async def acquire_slot(limiter, level):
+    """Wait for a limiter slot on the blocking pool, since waiting blocks.
+
+    If the coroutine is cancelled meanwhile, the pool thread keeps waiting; the slot it
+    ends up with is released there and then instead of being held forever.
+    """
+    future = asyncio.get_running_loop().run_in_executor(blocking_executor, limiter.acquire, level)
+    try:
+        await asyncio.shield(future)
+    except asyncio.CancelledError:
+        def release_unused(acquired):
+            if not acquired.cancelled() and acquired.exception() is None:
+                limiter.release()
+        future.add_done_callback(release_unused)
+        raise
+
+
+async def fetch_video_metadata(session, video_url):
+    """Coroutine version of youtube_utils.get_youtube_video_metadata."""
+    video_id = get_video_id(video_url)
+    if not video_id:
+        return {'error': 'Invalid YouTube URL'}
+
+    # The sqlite cache backend can block on a locked database
+    cached = await run_blocking(get_cache().get, 'metadata', video_id)
+    if cached is not None:
+        return cached
+
+    api_key = load_api_key("youtube_api_key")
+    url = f"https://www.googleapis.com/youtube/v3/videos?id={video_id}&key={api_key}&part=snippet,contentDetails"
+    try:
+        with timed('metadata'):
+            async with session.get(url, timeout=ClientTimeout(total=30)) as response:
+                response.raise_for_status()
+                data = await response.json()
+
+        if 'items' not in data or not data['items']:
+            return {'error': 'Video not found or no metadata available.'}
+
+        metadata = _parse_video_metadata(data['items'][0])
+        await run_blocking(get_cache().set, 'metadata', video_id, metadata)
+        return metadata
+    except Exception as e:
+        logger.error(f"Error retrieving metadata for video URL {video_url}: {str(e)}")
+        return {'error': str(e)}
+
+
+async def post_with_retry(session, url, budget=None, **kwargs):
+    """Coroutine version of db.post_with_retry. Returns (status, body)."""
+    deadline = time.monotonic() + (admission_timeout(PRIORITY_INTERACTIVE) if budget is None else budget)
+    for attempt in range(db.DIFY_MAX_RETRIES + 1):
+        try:
+            async with session.post(url, **kwargs) as response:
+                status = response.status
+                retry_after = response.headers.get('Retry-After', '')
+                body = await response.json(content_type=None)
+        except ClientConnectorError:
+            # The connection was never made, so Dify did not see the request
+            if attempt == db.DIFY_MAX_RETRIES:
+                raise
+            delay = db.DIFY_BACKOFF * 2 ** attempt + random.uniform(0, db.DIFY_BACKOFF)
+            if delay > deadline - time.monotonic():
+                raise
+        else:
+            if status not in db.RETRY_STATUS_CODES or attempt == db.DIFY_MAX_RETRIES:
+                return status, body
+            if retry_after.isdigit():
+                delay = int(retry_after)
+            else:
+                delay = db.DIFY_BACKOFF * 2 ** attempt + random.uniform(0, db.DIFY_BACKOFF)
+            if delay > deadline - time.monotonic():
+                return status, body
+        await asyncio.sleep(delay)
+
+
+async def create_document_vector(session, title, text):
+    """Coroutine version of db.create_document_vector."""
+    api_key = load_api_key('dify_datasets_api_key')
+    url = f'https://api.dify.ai/v1/datasets/{db.dataset_id}/document/create-by-text'
+    headers = {
+        'Authorization': f'Bearer {api_key}',
+        'Content-Type': 'application/json'
+    }
+    data = {
+        "name": title,
+        "text": text,
+        "indexing_technique": "high_quality",
+        "process_rule": {
+            "mode": "automatic"
+        }
+    }
+    limiter = limiters['dify']
+    await acquire_slot(limiter, PRIORITY_INTERACTIVE)
+    started = time.monotonic()
+    try:
+        with timed('dify_index'):
+            status, body = await post_with_retry(session, url, headers=headers, json=data, timeout=ClientTimeout(total=60))
+    finally:
+        limiter.release(time.monotonic() - started)
+    if status == 200:
+        return body
+    return {'error': str(body)}
+
+
+async def create_document_db(document):
+    """Coroutine version of db.create_document_db."""
+    with timed('firestore_write'):
+        write_time, doc_ref = await get_async_firestore_client().collection('articles').add(document)
+    return doc_ref.id
+
+
+async def find_document_by_hash(hash_value, user_id):
+    """Coroutine version of db.find_document_by_hash."""
+    query = (
+        get_async_firestore_client().collection('articles')
+        .where('content_hash', '==', hash_value)
+        .where('user_id', '==', user_id)
+        .limit(1)
+    )
+    async for doc in query.stream():
+        return doc.id, doc.to_dict()
+    return None
+
+
+async def find_vector_id_by_hash(hash_value):
+    """Coroutine version of db.find_vector_id_by_hash."""
+    query = get_async_firestore_client().collection('articles').where('content_hash', '==', hash_value).limit(1)
+    async for doc in query.stream():
+        return doc.to_dict().get('vector_id')
+    return None
+
+
+async def video_metadata_endpoint(request):
+    video_url = request.query.get('url')
+    if not video_url:
+        return json_response({"error": "No URL provided"}, 400)
+    return json_response(await fetch_video_metadata(request.app['http'], video_url))
+
+
+async def video_transcript_endpoint(request):
+    # youtube-transcript-api has no async interface, so the fetch itself runs on a thread
+    return json_response(await run_blocking(get_youtube_transcript, request.query.get('url')))
+
+
+async def create_document_endpoint(request):
+    data = await request.post()
+    document, error = db.build_document(data)
+    if error:
+        return json_response({'error': error}, 400)
+
+    force = data.get('force', '0') in ('1', 'true')
+    # Deduplication is per user, so only the same user's identical submissions are coalesced
+    key = f"{document['user_id']}:{document['content_hash']}"
+    try:
+        body, status = await document_flight.do(key, create_document, request.app['http'], document, force)
+    except Overloaded as e:
+        return json_response({"error": str(e)}, 429, headers={"Retry-After": str(e.retry_after)})
+    return json_response(body, status)
+
+
+async def create_document(session, document, force):
+    """Coroutine version of main.create_document. Returns (body, status)."""
+    vector_id = None
+    if not force:
+        existing = await find_document_by_hash(document['content_hash'], document['user_id'])
+        if existing is not None:
+            db_id, stored = existing
+            logger.info(f'Duplicate of {db_id}, skipping indexing')
+            return {
+                "document": stored,
+                "db_id": db_id,
+                "vector_id": stored.get('vector_id'),
+                "duplicate": True
+            }, 200
+        # Another user indexed the same content: reuse its vector, but store this user's own article
+        vector_id = await find_vector_id_by_hash(document['content_hash'])
+
+    if vector_id is None:
+        document_vector = await create_document_vector(session, document['title'], document['content'])
+        if 'error' in document_vector:
+            return {"error": str(document_vector)}, 500
+        vector_id = document_vector['document']['id']
+    logger.info(f"Vector ID: {vector_id}")
+    document['vector_id'] = vector_id
+
+    db_id = await create_document_db(document)
+    logger.info(f'Database ID: {db_id}')
+    return {
+        "document": document,
+        "db_id": db_id,
+        "vector_id": vector_id,
+        "duplicate": False
+    }, 200
+
+
+def wsgi_fallback(flask_app):
+    """Handler that serves a request with the Flask app on the blocking pool, streaming its body."""
+    async def handler(request):
+        environ = EnvironBuilder(
+            path=request.path,
+            base_url=f"{request.scheme}://{request.host}",
+            method=request.method,
+            query_string=request.query_string,
+            headers=list(request.headers.items()),
+            data=await request.read()
+        ).get_environ()
+        environ['REMOTE_ADDR'] = request.remote or ''
+
+        app_iter, status, headers = await run_blocking(
+            functools.partial(run_wsgi_app, flask_app, environ), executor=fallback_executor
+        )
+        code, _, reason = status.partition(' ')
+        response = web.StreamResponse(status=int(code), reason=reason or None)
+        for name, value in headers.items():
+            if name.lower() not in HOP_BY_HOP_HEADERS:
+                response.headers.add(name, value)
+
+        # Pull one chunk at a time so streamed (NDJSON/SSE) responses stay incremental
+        iterator = iter(app_iter)
+        try:
+            await response.prepare(request)
+            while True:
+                chunk = await run_blocking(next, iterator, None, executor=fallback_executor)
+                if chunk is None:
+                    break
+                if chunk:
+                    await response.write(chunk)
+            await response.write_eof()
+        finally:
+            if hasattr(app_iter, 'close'):
+                await run_blocking(app_iter.close, executor=fallback_executor)
+        return response
+
+    return handler
+
+
+@web.middleware
+async def record_request_timing(request, handler):
+    started = time.perf_counter()
+    response = await handler(request)
+    # Flask records the routes it serves; only the native ones are observed here
+    if request.path in NATIVE_ROUTES:
+        request_duration.observe(time.perf_counter() - started, endpoint=request.path, status=response.status)
+    return response
+
+
+async def _open_http_session(app):
+    app['http'] = ClientSession(connector=TCPConnector(limit=HTTP_POOL_SIZE))
+
+
+async def _close_http_session(app):
+    await app['http'].close()
+
+
+def create_app(flask_app):
+    app = web.Application(middlewares=[record_request_timing])
+    app.on_startup.append(_open_http_session)
+    app.on_cleanup.append(_close_http_session)
+    app.router.add_get('/video-metadata', video_metadata_endpoint)
+    app.router.add_get('/video-transcript', video_transcript_endpoint)
+    app.router.add_post('/create-document', create_document_endpoint)
+    app.router.add_route('*', '/{tail:.*}', wsgi_fallback(flask_app))
+    return app
+
+
+def serve(flask_app, host='0.0.0.0', port=5000):
+    logging.basicConfig(level=logging.INFO)
+    web.run_app(create_app(flask_app), host=host, port=port)
@@ -0,0 +1,130 @@
+# audio_store.py
+
+import os
+from flask import current_app
+from google.cloud import firestore
+from google.api_core.exceptions import NotFound
+from clients import get_firestore_client
+
+AUDIO_SAMPLE_RATE = 16000
+AUDIO_CHANNELS = 1
+# Least recently used audio is deleted once the indexed total goes over this many bytes
+AUDIO_MAX_BUCKET_BYTES = int(os.environ.get('AUDIO_MAX_BUCKET_BYTES', 50 * 1024 ** 3))
+# Bucket lifecycle rule: audio objects older than this are deleted by GCS itself
+AUDIO_MAX_AGE_DAYS = int(os.environ.get('AUDIO_MAX_AGE_DAYS', 30))
+
+AUDIO_INDEX_COLLECTION = 'audio_blobs'
+AUDIO_USAGE_DOCUMENT = ('audio_blobs_usage', 'total')
+
+
+def audio_blob_name(video_id, codec, sample_rate=AUDIO_SAMPLE_RATE, channels=AUDIO_CHANNELS):
+    """Deterministic object name for a video's audio with the given encoding parameters."""
+    return f'audio/{video_id}-{sample_rate}hz-{channels}ch.{codec}'
+
+
+def find_stored_audio(bucket, video_id, extensions):
+    """Return a stored audio blob for the video in any of the given encodings, or None."""
+    # Every encoding of a video shares the audio/<id>- prefix, so one listing finds them all
+    for blob in bucket.list_blobs(prefix=f'audio/{video_id}-'):
+        if blob.name.rsplit('.', 1)[-1] in extensions:
+            return blob
+    return None
+
+
+def time_map_blob_name(blob_name):
+    """Sidecar object holding the trimmed-to-original time map of silence-trimmed audio."""
+    return f'{blob_name}.timemap.json'
+
+
+def _index_document(blob_name):
+    return get_firestore_client().collection(AUDIO_INDEX_COLLECTION).document(blob_name.replace('/', '_'))
+
+
+def _usage_document():
+    return get_firestore_client().collection(AUDIO_USAGE_DOCUMENT[0]).document(AUDIO_USAGE_DOCUMENT[1])
+
+
+def touch_audio_blob(blob_name):
+    """Mark an indexed audio object as recently used so eviction keeps it."""
+    try:
+        # update() rather than a merge: audio uploaded before the index existed has no entry to touch
+        _index_document(blob_name).update({'last_accessed': firestore.SERVER_TIMESTAMP})
+    except NotFound:
+        pass
+    except Exception as e:
+        current_app.logger.error(f"Error updating audio index for {blob_name}: {str(e)}")
+
+
+def record_audio_blob(bucket, blob, video_id, codec, sample_rate=AUDIO_SAMPLE_RATE, channels=AUDIO_CHANNELS):
+    """Add a freshly uploaded audio object to the index and evict old audio if the bucket is over its cap."""
+    try:
+        if blob.size is None:
+            blob.reload()
+        doc_ref = _index_document(blob.name)
+        previous = doc_ref.get()
+        previous_size = (previous.to_dict() or {}).get('size', 0) if previous.exists else 0
+        doc_ref.set({
+            'video_id': video_id,
+            'blob_name': blob.name,
+            'codec': codec,
+            'sample_rate': sample_rate,
+            'channels': channels,
+            'size': blob.size,
+            'created_at': firestore.SERVER_TIMESTAMP,
+            'last_accessed': firestore.SERVER_TIMESTAMP
+        })
+        _usage_document().set({'bytes': firestore.Increment(blob.size - previous_size)}, merge=True)
+        evict_audio_blobs(bucket)
+    except Exception as e:
+        current_app.logger.error(f"Error recording {blob.name} in audio index: {str(e)}")
+
+
+def evict_audio_blobs(bucket, max_bytes=AUDIO_MAX_BUCKET_BYTES):
+    """Delete least recently used audio objects until the indexed total fits in max_bytes. Returns bytes freed."""
+    usage = _usage_document().get().to_dict() or {}
+    total = usage.get('bytes', 0)
+    if total <= max_bytes:
+        return 0
+
+    freed = 0
+    for doc in get_firestore_client().collection(AUDIO_INDEX_COLLECTION).order_by('last_accessed').stream():
+        if total - freed <= max_bytes:
+            break
+        entry = doc.to_dict()
+        if 'blob_name' not in entry:
+            # Left behind by an older touch_audio_blob that could create bare entries
+            doc.reference.delete()
+            continue
+        for name in (entry['blob_name'], time_map_blob_name(entry['blob_name'])):
+            try:
+                bucket.blob(name).delete()
+            except NotFound:
+                pass
+        doc.reference.delete()
+        freed += entry.get('size', 0)
+        current_app.logger.info(f"Evicted audio blob {entry['blob_name']}")
+
+    _usage_document().set({'bytes': firestore.Increment(-freed)}, merge=True)
+    return freed
+
+
+def ensure_lifecycle_policy(bucket):
+    """Install a bucket lifecycle rule that deletes old audio objects."""
+    bucket.reload()
+    rules = list(bucket.lifecycle_rules)
+    rule_exists = any(
+        rule.get('action', {}).get('type') == 'Delete'
+        and rule.get('condition', {}).get('matchesPrefix') == ['audio/']
+        for rule in rules
+    )
+    if not rule_exists:
+        bucket.add_lifecycle_delete_rule(age=AUDIO_MAX_AGE_DAYS, matches_prefix=['audio/'])
+        bucket.patch()
+    return list(bucket.lifecycle_rules)
+
+
+# Only with python audio_store.py
+if __name__ == '__main__':
+    from clients import get_bucket
+    from youtube_utils import BUCKET_NAME
+    print(ensure_lifecycle_policy(get_bucket(BUCKET_NAME)))
@@ -0,0 +1,46 @@
+# benchmarks/compare.py
+"""Compare two benchmark result files scenario by scenario.
+
+    python -m benchmarks.compare benchmarks/results/before.json benchmarks/results/after.json
+"""
+
+import sys
+import json
+
+METRICS = ('p50_ms', 'p95_ms', 'p99_ms', 'throughput_rps', 'peak_rss_mb', 'peak_tmp_bytes', 'errors')
+
+
+def load(path):
+    with open(path) as file:
+        report = json.load(file)
+    return {(scenario['endpoint'], scenario['concurrency']): scenario for scenario in report['scenarios']}
+
+
+def change(before, after):
+    if before in (None, 0):
+        return '' if after in (None, 0) else '   new'
+    if after is None:
+        return ''
+    return f"{(after - before) / before * 100:+6.1f}%"
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 2:
+        print(__doc__)
+        return 1
+    before, after = load(argv[0]), load(argv[1])
+
+    for key in sorted(set(before) & set(after)):
+        endpoint, concurrency = key
+        print(f"{endpoint} c={concurrency}")
+        for metric in METRICS:
+            old, new = before[key].get(metric), after[key].get(metric)
+            print(f"  {metric:>16}: {old!s:>12} -> {new!s:>12} {change(old, new)}")
+    for key in sorted(set(before) ^ set(after)):
+        print(f"{key[0]} c={key[1]}: only in {'first' if key in before else 'second'} run")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,454 @@
+# benchmarks/fakes.py
+"""Local stand-ins for GCS, Speech-to-Text, Firestore, the YouTube Data API,
+the transcript proxy, Dify and yt-dlp, with configurable latency and failure rates."""
+
+import io
+import math
+import time
+import uuid
+import wave
+import random
+import zlib
+import threading
+from array import array
+from datetime import timedelta
+from types import SimpleNamespace
+from urllib.parse import urlparse, parse_qs
+
+# Services whose latency and failure rate can be configured
+SERVICES = ('youtube', 'captions', 'ytdlp', 'gcs', 'speech', 'firestore', 'dify')
+
+
+class FakeServiceError(Exception):
+    """Raised by a stand-in when it simulates a failure."""
+
+
+class FakeServices:
+    """Shared configuration and state for every stand-in."""
+
+    def __init__(self, latency=None, failure_rate=None, caption_ratio=0.5, audio_seconds=60, seed=0):
+        self.latency = {service: 0.0 for service in SERVICES}
+        self.latency.update(latency or {})
+        self.failure_rate = {service: 0.0 for service in SERVICES}
+        self.failure_rate.update(failure_rate or {})
+        self.caption_ratio = caption_ratio
+        self.audio_seconds = audio_seconds
+        self.calls = {service: 0 for service in SERVICES}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._wav = None
+
+    def call(self, service):
+        """Account for one call: sleep for the configured latency and maybe fail."""
+        with self._lock:
+            self.calls[service] += 1
+            failed = self._random.random() < self.failure_rate[service]
+        if self.latency[service]:
+            time.sleep(self.latency[service])
+        if failed:
+            raise FakeServiceError(f"Simulated {service} failure")
+
+    def has_captions(self, video_id):
+        # Stable per video so repeated requests take the same path
+        return (zlib.crc32(video_id.encode()) % 1000) / 1000 < self.caption_ratio
+
+    def wav_bytes(self):
+        """16 kHz mono 16-bit WAV of audio_seconds, generated once."""
+        if self._wav is None:
+            rate = 16000
+            samples = array('h', (
+                int(8000 * math.sin(2 * math.pi * 220 * i / rate)) for i in range(rate)
+            ))
+            buffer = io.BytesIO()
+            with wave.open(buffer, 'wb') as wav:
+                wav.setnchannels(1)
+                wav.setsampwidth(2)
+                wav.setframerate(rate)
+                second = samples.tobytes()
+                for _ in range(int(self.audio_seconds)):
+                    wav.writeframes(second)
+            self._wav = buffer.getvalue()
+        return self._wav
+
+
+class FakeResponse:
+    def __init__(self, status_code, payload, headers=None):
+        self.status_code = status_code
+        self._payload = payload
+        self.headers = headers or {}
+
+    def json(self):
+        return self._payload
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise FakeServiceError(f"HTTP {self.status_code}")
+
+
+class FakeSession:
+    """Stands in for the pooled requests sessions (YouTube Data API, Dify, callbacks)."""
+
+    def __init__(self, services):
+        self.services = services
+
+    def get(self, url, **kwargs):
+        if 'googleapis.com/youtube/v3/videos' in url:
+            try:
+                self.services.call('youtube')
+            except FakeServiceError:
+                return FakeResponse(503, {'error': 'unavailable'})
+            ids = parse_qs(urlparse(url).query).get('id', [''])[0].split(',')
+            return FakeResponse(200, {'items': [_video_item(video_id) for video_id in ids if video_id]})
+        return FakeResponse(404, {'error': 'not found'})
+
+    def post(self, url, **kwargs):
+        if 'api.dify.ai' in url:
+            try:
+                self.services.call('dify')
+            except FakeServiceError:
+                return FakeResponse(503, {'error': 'unavailable'})
+            return FakeResponse(200, {'document': {'id': uuid.uuid4().hex}, 'batch': ''})
+        return FakeResponse(200, {})
+
+
+def _video_item(video_id):
+    return {
+        'id': video_id,
+        'snippet': {
+            'title': f'Video {video_id}',
+            'description': 'Benchmark video',
+            'thumbnails': {},
+            'channelTitle': 'Benchmark',
+            'publishedAt': '2024-01-01T00:00:00Z',
+            'tags': ['benchmark'],
+            'defaultAudioLanguage': 'en'
+        }
+    }
+
+
+def make_transcript_api(services):
+    """Class with the YouTubeTranscriptApi.get_transcript interface."""
+    from youtube_transcript_api import TranscriptsDisabled
+
+    class FakeTranscriptApi:
+        @staticmethod
+        def get_transcript(video_id, proxies=None, **kwargs):
+            services.call('captions')
+            if not services.has_captions(video_id):
+                raise TranscriptsDisabled(video_id)
+            return [
+                {'text': f'caption line {i}', 'start': i * 5.0, 'duration': 5.0}
+                for i in range(int(services.audio_seconds // 5))
+            ]
+
+    return FakeTranscriptApi
+
+
+def make_youtube_dl(services):
+    """Class with the yt_dlp.YoutubeDL interface that writes generated audio instead of downloading."""
+
+    class FakeYoutubeDL:
+        def __init__(self, params=None):
+            self.params = params or {}
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc_info):
+            return False
+
+        def extract_info(self, url, download=True):
+            services.call('ytdlp')
+            video_id = parse_qs(urlparse(url).query).get('v', [''])[0]
+            info = {'id': video_id, 'url': url, 'ext': 'wav', 'format_id': 'fake', 'acodec': 'pcm_s16le', 'audio_channels': 1}
+            if download:
+                self.process_ie_result(info, download=True)
+            return info
+
+        def process_ie_result(self, info, download=True):
+            data = services.wav_bytes()
+            for hook in self.params.get('progress_hooks', []):
+                hook({'status': 'downloading', 'downloaded_bytes': len(data), 'total_bytes': len(data)})
+            outtmpl = self.params.get('outtmpl')
+            if isinstance(outtmpl, dict):
+                outtmpl = outtmpl.get('default')
+            if download and outtmpl:
+                # The real FFmpegExtractAudio postprocessor leaves <outtmpl>.<preferredcodec> behind
+                codec = next(
+                    (pp.get('preferredcodec') for pp in self.params.get('postprocessors', []) if pp.get('key') == 'FFmpegExtractAudio'),
+                    'wav'
+                )
+                with open(f'{outtmpl}.{codec}', 'wb') as file:
+                    file.write(data)
+            return info
+
+    return FakeYoutubeDL
+
+
+class FakeBlob:
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+        self.chunk_size = None
+
+    @property
+    def size(self):
+        return self.bucket.objects.get(self.name)
+
+    def exists(self):
+        self.bucket.services.call('gcs')
+        return self.name in self.bucket.objects
+
+    def reload(self):
+        self.bucket.services.call('gcs')
+
+    def upload_from_filename(self, path, **kwargs):
+        self.bucket.services.call('gcs')
+        with open(path, 'rb') as file:
+            self.bucket.objects[self.name] = len(file.read())
+
+    def upload_from_string(self, data, content_type=None, **kwargs):
+        self.bucket.services.call('gcs')
+        self.bucket.objects[self.name] = len(data)
+        if isinstance(data, str):
+            self.bucket.texts[self.name] = data
+
+    def download_as_text(self):
+        from google.api_core.exceptions import NotFound
+        self.bucket.services.call('gcs')
+        if self.name not in self.bucket.texts:
+            raise NotFound(self.name)
+        return self.bucket.texts[self.name]
+
+    def open(self, mode='rb', **kwargs):
+        blob = self
+
+        class Writer(io.BytesIO):
+            def close(self):
+                blob.bucket.objects[blob.name] = len(self.getvalue())
+                super().close()
+
+        return Writer()
+
+    def generate_signed_url(self, **kwargs):
+        return f'https://storage.fake/{self.bucket.name}/{self.name}?X-Goog-Signature=fake'
+
+    def delete(self):
+        self.bucket.services.call('gcs')
+        self.bucket.objects.pop(self.name, None)
+        self.bucket.texts.pop(self.name, None)
+
+
+class FakeBucket:
+    def __init__(self, services, name):
+        self.services = services
+        self.name = name
+        self.objects = {}  # name -> size in bytes
+        self.texts = {}  # name -> content of small text objects such as time maps
+        self.lifecycle_rules = []
+
+    def blob(self, name):
+        return FakeBlob(self, name)
+
+    def list_blobs(self, max_results=None, prefix=None):
+        self.services.call('gcs')
+        names = [name for name in self.objects if not prefix or name.startswith(prefix)]
+        return [FakeBlob(self, name) for name in names[:max_results]]
+
+
+class FakeOperation:
+    def __init__(self, services, response):
+        self.services = services
+        self.response = response
+        self.ready_at = time.monotonic() + services.latency['speech']
+        self.metadata = SimpleNamespace(progress_percent=0)
+        self.operation = SimpleNamespace(name=f'operations/{uuid.uuid4().hex}')
+
+    def done(self):
+        return time.monotonic() >= self.ready_at
+
+    def result(self, timeout=None):
+        remaining = self.ready_at - time.monotonic()
+        if remaining > 0:
+            time.sleep(remaining)
+        self.metadata.progress_percent = 100
+        return self.response
+
+
+class FakeSpeechClient:
+    """Recognition returns one diarized sentence per 10 seconds of audio after the configured latency."""
+
+    def __init__(self, services):
+        self.services = services
+
+    def long_running_recognize(self, config=None, audio=None, **kwargs):
+        with self.services._lock:
+            self.services.calls['speech'] += 1
+            failed = self.services._random.random() < self.services.failure_rate['speech']
+        if failed:
+            raise FakeServiceError("Simulated speech failure")
+        results = []
+        for sentence in range(int(self.services.audio_seconds // 10)):
+            words = [
+                SimpleNamespace(
+                    word=f'word{index}',
+                    start_time=timedelta(seconds=sentence * 10 + index * 0.5),
+                    end_time=timedelta(seconds=sentence * 10 + index * 0.5 + 0.4),
+                    speaker_tag=sentence % 2 + 1
+                )
+                for index in range(20)
+            ]
+            alternative = SimpleNamespace(
+                transcript=' '.join(word.word for word in words),
+                confidence=0.9,
+                words=words
+            )
+            results.append(SimpleNamespace(alternatives=[alternative]))
+        return FakeOperation(self.services, SimpleNamespace(results=results))
+
+
+class FakeSnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self):
+        return dict(self._data) if self._data is not None else None
+
+
+class FakeDocument:
+    def __init__(self, firestore, collection, doc_id):
+        self.firestore = firestore
+        self.collection = collection
+        self.id = doc_id
+
+    def get(self):
+        self.firestore.services.call('firestore')
+        with self.firestore.lock:
+            data = self.firestore.data.get(self.collection, {}).get(self.id)
+            return FakeSnapshot(self, dict(data) if data is not None else None)
+
+    def set(self, data, merge=False):
+        self.firestore.services.call('firestore')
+        self.firestore.apply(self.collection, self.id, data, merge)
+
+    def update(self, data):
+        # Like Firestore, update() only works on an existing document
+        with self.firestore.lock:
+            exists = self.id in self.firestore.data.get(self.collection, {})
+        if not exists:
+            from google.api_core.exceptions import NotFound
+            raise NotFound(f"{self.collection}/{self.id}")
+        self.set(data, merge=True)
+
+    def delete(self):
+        self.firestore.services.call('firestore')
+        with self.firestore.lock:
+            self.firestore.data.get(self.collection, {}).pop(self.id, None)
+
+
+class FakeQuery:
+    def __init__(self, firestore, collection, filters=None, order=None, limit=None):
+        self.firestore = firestore
+        self.collection = collection
+        self.filters = filters or []
+        self.order = order
+        self._limit = limit
+
+    def where(self, field, op, value):
+        return FakeQuery(self.firestore, self.collection, self.filters + [(field, op, value)], self.order, self._limit)
+
+    def order_by(self, field, **kwargs):
+        return FakeQuery(self.firestore, self.collection, self.filters, field, self._limit)
+
+    def limit(self, count):
+        return FakeQuery(self.firestore, self.collection, self.filters, self.order, count)
+
+    def stream(self):
+        self.firestore.services.call('firestore')
+        with self.firestore.lock:
+            rows = list(self.firestore.data.get(self.collection, {}).items())
+        for field, op, value in self.filters:
+            if op != '==':
+                raise NotImplementedError(op)
+            rows = [(doc_id, data) for doc_id, data in rows if data.get(field) == value]
+        if self.order:
+            rows.sort(key=lambda row: row[1].get(self.order, 0))
+        if self._limit is not None:
+            rows = rows[:self._limit]
+        return iter([
+            FakeSnapshot(FakeDocument(self.firestore, self.collection, doc_id), dict(data))
+            for doc_id, data in rows
+        ])
+
+
+class FakeCollection(FakeQuery):
+    def __init__(self, firestore, name):
+        super().__init__(firestore, name)
+
+    def document(self, doc_id=None):
+        return FakeDocument(self.firestore, self.collection, doc_id or uuid.uuid4().hex)
+
+    def add(self, data):
+        document = self.document()
+        document.set(data)
+        return time.time(), document
+
+
+class FakeBatch:
+    def __init__(self, firestore):
+        self.firestore = firestore
+        self.writes = []
+
+    def set(self, reference, data, merge=False):
+        self.writes.append((reference, data, merge))
+
+    def commit(self):
+        self.firestore.services.call('firestore')
+        for reference, data, merge in self.writes:
+            self.firestore.apply(reference.collection, reference.id, data, merge)
+
+
+class FakeFirestore:
+    def __init__(self, services):
+        self.services = services
+        self.data = {}  # collection -> {doc_id: data}
+        self.lock = threading.Lock()
+
+    def collection(self, name):
+        return FakeCollection(self, name)
+
+    def batch(self):
+        return FakeBatch(self)
+
+    def apply(self, collection, doc_id, data, merge):
+        from google.cloud import firestore
+
+        with self.lock:
+            documents = self.data.setdefault(collection, {})
+            current = dict(documents.get(doc_id, {})) if merge else {}
+            for key, value in data.items():
+                if value is firestore.SERVER_TIMESTAMP:
+                    value = time.time()
+                elif isinstance(value, firestore.Increment):
+                    value = current.get(key, 0) + value.value
+                current[key] = value
+            documents[doc_id] = current
+
+
+def install(services, bucket_name):
+    """Register every stand-in with the client registry and patch the third-party entry points."""
+    import yt_dlp
+    import youtube_utils
+    from clients import register_client
+
+    register_client('storage', SimpleNamespace(bucket=lambda name: FakeBucket(services, name)))
+    register_client(f'bucket:{bucket_name}', FakeBucket(services, bucket_name))
+    register_client('speech', FakeSpeechClient(services))
+    register_client('firestore', FakeFirestore(services))
+    for name in ('youtube', 'dify', 'callbacks'):
+        register_client(f'http:{name}', FakeSession(services))
+    youtube_utils.YouTubeTranscriptApi = make_transcript_api(services)
+    yt_dlp.YoutubeDL = make_youtube_dl(services)
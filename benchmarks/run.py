@@ -0,0 +1,228 @@
+# benchmarks/run.py
+"""End-to-end benchmark of the Flask endpoints against local stand-ins.
+
+    python -m benchmarks.run --concurrency 1,8,32 --requests 200 \
+        --latency youtube=0.08,captions=0.3,ytdlp=2,gcs=0.2,speech=5,dify=0.4 \
+        --failure-rate dify=0.02
+
+Each (endpoint, concurrency) scenario reports p50/p95/p99 latency, throughput,
+errors, peak RSS and peak temp-disk use. Results are written to
+benchmarks/results/<timestamp>.json; compare two runs with benchmarks.compare.
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+ENDPOINTS = ('v', 'transcribe', 'video-metadata', 'create-document')
+
+
+def parse_service_values(text):
+    """Parse "youtube=0.1,speech=5" into {'youtube': 0.1, 'speech': 5.0}."""
+    values = {}
+    for item in filter(None, (text or '').split(',')):
+        service, value = item.split('=')
+        values[service.strip()] = float(value)
+    return values
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def directory_bytes(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass  # Removed while walking
+    return total
+
+
+def current_rss_bytes():
+    """Resident set size of this process right now; None where /proc is unavailable."""
+    try:
+        with open('/proc/self/status') as file:
+            for line in file:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+class ResourceSampler:
+    """Samples the size of a directory and the process RSS in the background and keeps the peaks."""
+
+    def __init__(self, path, interval=0.05):
+        self.path = path
+        self.interval = interval
+        self.peak = 0
+        self.peak_rss = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _sample(self):
+        self.peak = max(self.peak, directory_bytes(self.path))
+        rss = current_rss_bytes()
+        if rss is not None:
+            self.peak_rss = max(self.peak_rss or 0, rss)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._sample()
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        # A scenario shorter than one interval still gets a sample taken at its end
+        self._sample()
+
+
+def make_request(client, endpoint, video_id):
+    url = f'https://www.youtube.com/watch?v={video_id}'
+    if endpoint == 'create-document':
+        return client.post('/create-document', data={
+            'title': f'Video {video_id}',
+            'content': f'Transcript of {video_id} ' * 50,
+            'metadata': json.dumps({'video_id': video_id})
+        })
+    return client.get(f'/{endpoint}', query_string={'url': url})
+
+
+def run_scenario(app, endpoint, concurrency, total, video_pool, tmp_dir):
+    def one(index):
+        # A pool of 0 means every request is for a new video (cold path)
+        video_id = f'bench{index % video_pool:06d}' if video_pool else f'b{uuid.uuid4().hex[:10]}'
+        client = app.test_client()
+        started = time.perf_counter()
+        response = make_request(client, endpoint, video_id)
+        return time.perf_counter() - started, response.status_code
+
+    with ResourceSampler(tmp_dir) as sampler:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            outcomes = list(executor.map(one, range(total)))
+        wall = time.perf_counter() - started
+
+    latencies = [latency for latency, _ in outcomes]
+    return {
+        'endpoint': endpoint,
+        'concurrency': concurrency,
+        'requests': total,
+        'errors': sum(status >= 400 for _, status in outcomes),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        'throughput_rps': round(total / wall, 2),
+        'wall_seconds': round(wall, 3),
+        # Sampled during this scenario only; ru_maxrss would carry over the peak of earlier scenarios
+        'peak_rss_mb': round(sampler.peak_rss / (1024 * 1024), 1) if sampler.peak_rss is not None else None,
+        'peak_tmp_bytes': sampler.peak
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--endpoints', default=','.join(ENDPOINTS))
+    parser.add_argument('--concurrency', default='1,8,32')
+    parser.add_argument('--requests', type=int, default=100, help='Requests per scenario')
+    parser.add_argument('--video-pool', type=int, default=0, help='Distinct videos to cycle through; 0 = new video per request')
+    parser.add_argument('--latency', default='youtube=0.05,captions=0.2,ytdlp=0.5,gcs=0.05,speech=1,firestore=0.02,dify=0.2')
+    parser.add_argument('--failure-rate', default='')
+    parser.add_argument('--caption-ratio', type=float, default=0.5, help='Share of videos that have native captions')
+    parser.add_argument('--audio-seconds', type=int, default=60)
+    parser.add_argument('--label', default='')
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args(argv)
+
+    # Configure the app for local stand-ins before it is imported
+    work_dir = tempfile.mkdtemp(prefix='yt-bench-')
+    tmp_dir = os.path.join(work_dir, 'tmp')
+    os.makedirs(tmp_dir)
+    credentials_path = os.path.join(work_dir, 'credentials.json')
+    with open(credentials_path, 'w') as file:
+        json.dump({'youtube_api_key': 'fake', 'dify_datasets_api_key': 'fake'}, file)
+    os.environ.update({
+        'GOOGLE_APPLICATION_CREDENTIALS': credentials_path,
+        'AUDIO_TMP_DIR': tmp_dir,
+        'CACHE_BACKEND': 'memory',
+        'LOCK_DIR': os.path.join(work_dir, 'locks'),
+        'CHECKPOINT_DIR': os.path.join(work_dir, 'checkpoints'),
+        # Captions go through the proxy pool as in production; the fake transcript API ignores the proxy
+        'TRANSCRIPT_PROXIES': 'http://bench-proxy-1:8080,http://bench-proxy-2:8080',
+    })
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    from benchmarks.fakes import FakeServices, install
+    import youtube_utils
+    from main import app
+
+    services = FakeServices(
+        latency=parse_service_values(args.latency),
+        failure_rate=parse_service_values(args.failure_rate),
+        caption_ratio=args.caption_ratio,
+        audio_seconds=args.audio_seconds
+    )
+    install(services, youtube_utils.BUCKET_NAME)
+
+    scenarios = []
+    try:
+        for endpoint in args.endpoints.split(','):
+            for concurrency in (int(value) for value in args.concurrency.split(',')):
+                result = run_scenario(app, endpoint, concurrency, args.requests, args.video_pool, tmp_dir)
+                scenarios.append(result)
+                print(
+                    f"{endpoint:>16} c={concurrency:<4} p50={result['p50_ms']:>9.1f}ms p95={result['p95_ms']:>9.1f}ms "
+                    f"p99={result['p99_ms']:>9.1f}ms {result['throughput_rps']:>8.1f} rps errors={result['errors']} "
+                    f"rss={result['peak_rss_mb']}MB tmp={result['peak_tmp_bytes']}B"
+                )
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        'label': args.label,
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'git_commit': git_commit(),
+        'config': vars(args),
+        'service_calls': services.calls,
+        'scenarios': scenarios
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"{datetime.now():%Y%m%d-%H%M%S}{'-' + args.label if args.label else ''}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump(report, file, indent=2)
+    print(f"Results written to {output}")
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+# cache.py
+
+import os
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from metrics import cache_requests
+
+# Backend selection: "memory" for a single worker, "sqlite" to share results between workers
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'memory')
+CACHE_PATH = os.environ.get('CACHE_PATH', '/app/tmp/cache.sqlite3')
+CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', 2048))
+CACHE_MAX_BYTES = int(os.environ.get('CACHE_MAX_BYTES', 256 * 1024 * 1024))
+
+# Time-to-live per kind of entry, in seconds
+CACHE_TTLS = {
+    'metadata': int(os.environ.get('CACHE_TTL_METADATA', 60 * 60)),
+    'captions': int(os.environ.get('CACHE_TTL_CAPTIONS', 7 * 24 * 60 * 60)),
+    'transcript': int(os.environ.get('CACHE_TTL_TRANSCRIPT', 30 * 24 * 60 * 60)),
+}
+# Negative entries (e.g. "no native captions") expire sooner so newly added captions get picked up
+NEGATIVE_TTL = int(os.environ.get('CACHE_TTL_NEGATIVE', 6 * 60 * 60))
+
+
+def cache_key(video_id, lang=None):
+    """Build the cache key for a video, optionally scoped to a language."""
+    return f"{video_id}:{lang}" if lang else video_id
+
+
+def _ttl_for(kind, negative):
+    if negative:
+        return NEGATIVE_TTL
+    return CACHE_TTLS.get(kind, 60 * 60)
+
+
+class _Cache:
+    """Shared lookup path that counts hits and misses per kind."""
+
+    def get(self, kind, key):
+        value = self._get(kind, key)
+        cache_requests.inc(kind=kind, result='miss' if value is None else 'hit')
+        return value
+
+
+class MemoryCache(_Cache):
+    """In-process LRU cache capped by entry count and serialized size."""
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # (kind, key) -> (expires_at, size, value)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def _get(self, kind, key):
+        with self._lock:
+            entry = self._entries.get((kind, key))
+            if entry is None:
+                return None
+            expires_at, size, value = entry
+            if expires_at < time.time():
+                del self._entries[(kind, key)]
+                self._bytes -= size
+                return None
+            self._entries.move_to_end((kind, key))
+            return value
+
+    def set(self, kind, key, value, negative=False):
+        size = len(json.dumps(value, default=str))
+        if size > self.max_bytes:
+            return
+        expires_at = time.time() + _ttl_for(kind, negative)
+        with self._lock:
+            previous = self._entries.pop((kind, key), None)
+            if previous is not None:
+                self._bytes -= previous[1]
+            self._entries[(kind, key)] = (expires_at, size, value)
+            self._bytes += size
+            # Evict least recently used entries until we are back under both caps
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+
+    def delete(self, kind, key):
+        with self._lock:
+            entry = self._entries.pop((kind, key), None)
+            if entry is not None:
+                self._bytes -= entry[1]
+
+
+class SQLiteCache(_Cache):
+    """On-disk cache shared by every worker process that points at the same file."""
+
+    def __init__(self, path=CACHE_PATH, max_entries=CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        conn = self._connection()
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS cache ('
+            ' kind TEXT NOT NULL,'
+            ' key TEXT NOT NULL,'
+            ' value TEXT NOT NULL,'
+            ' expires_at REAL NOT NULL,'
+            ' accessed_at REAL NOT NULL,'
+            ' PRIMARY KEY (kind, key))'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS cache_accessed_at ON cache (accessed_at)')
+        conn.commit()
+
+    def _connection(self):
+        # sqlite3 connections cannot be shared between threads, so keep one per thread
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _get(self, kind, key):
+        conn = self._connection()
+        now = time.time()
+        row = conn.execute(
+            'SELECT value, expires_at FROM cache WHERE kind = ? AND key = ?', (kind, key)
+        ).fetchone()
+        if row is None:
+            return None
+        value, expires_at = row
+        if expires_at < now:
+            conn.execute('DELETE FROM cache WHERE kind = ? AND key = ?', (kind, key))
+            conn.commit()
+            return None
+        conn.execute('UPDATE cache SET accessed_at = ? WHERE kind = ? AND key = ?', (now, kind, key))
+        conn.commit()
+        return json.loads(value)
+
+    def set(self, kind, key, value, negative=False):
+        conn = self._connection()
+        now = time.time()
+        conn.execute(
+            'INSERT OR REPLACE INTO cache (kind, key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)',
+            (kind, key, json.dumps(value, default=str), now + _ttl_for(kind, negative), now)
+        )
+        # Drop expired rows, then the least recently used ones beyond the entry cap
+        conn.execute('DELETE FROM cache WHERE expires_at < ?', (now,))
+        conn.execute(
+            'DELETE FROM cache WHERE rowid IN ('
+            ' SELECT rowid FROM cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)',
+            (self.max_entries,)
+        )
+        conn.commit()
+
+    def delete(self, kind, key):
+        conn = self._connection()
+        conn.execute('DELETE FROM cache WHERE kind = ? AND key = ?', (kind, key))
+        conn.commit()
+
+
+_BACKENDS = {
+    'memory': MemoryCache,
+    'sqlite': SQLiteCache,
+}
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Return the process-wide cache, creating the configured backend on first use."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                if CACHE_BACKEND not in _BACKENDS:
+                    raise ValueError(f"Unknown CACHE_BACKEND: {CACHE_BACKEND}")
+                _cache = _BACKENDS[CACHE_BACKEND]()
+    return _cache
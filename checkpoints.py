@@ -0,0 +1,98 @@
+# checkpoints.py
+
+import os
+import re
+import json
+import time
+import threading
+from clients import get_firestore_client
+
+# Backend selection: "local" keeps checkpoints on disk, "firestore" survives the container being replaced
+CHECKPOINT_BACKEND = os.environ.get('CHECKPOINT_BACKEND', 'local')
+CHECKPOINT_DIR = os.environ.get('CHECKPOINT_DIR', '/app/tmp/checkpoints')
+CHECKPOINT_COLLECTION = 'pipeline_checkpoints'
+# Older checkpoints are ignored; Speech keeps finished operations for a limited time
+CHECKPOINT_TTL = int(os.environ.get('CHECKPOINT_TTL', 24 * 60 * 60))
+
+
+def _document_id(key):
+    return re.sub(r'[^A-Za-z0-9_.:-]', '_', key)
+
+
+def _fresh(checkpoint):
+    if not checkpoint or checkpoint.get('updated_at', 0) < time.time() - CHECKPOINT_TTL:
+        return None
+    return checkpoint
+
+
+class LocalCheckpointStore:
+    """One JSON file per pipeline key, replaced atomically on every update."""
+
+    def __init__(self, directory=CHECKPOINT_DIR):
+        self.directory = directory
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        return os.path.join(self.directory, _document_id(key) + '.json')
+
+    def get(self, key):
+        try:
+            with open(self._path(key)) as file:
+                return _fresh(json.load(file))
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def update(self, key, **fields):
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            checkpoint = self.get(key) or {}
+            checkpoint.update(fields, updated_at=time.time())
+            path = self._path(key)
+            temp_path = f'{path}.{os.getpid()}.tmp'
+            with open(temp_path, 'w') as file:
+                json.dump(checkpoint, file)
+            os.replace(temp_path, path)
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+
+class FirestoreCheckpointStore:
+    """Checkpoints as documents in a Firestore collection, shared by every instance."""
+
+    def _document(self, key):
+        return get_firestore_client().collection(CHECKPOINT_COLLECTION).document(_document_id(key))
+
+    def get(self, key):
+        snapshot = self._document(key).get()
+        return _fresh(snapshot.to_dict()) if snapshot.exists else None
+
+    def update(self, key, **fields):
+        self._document(key).set({**fields, 'updated_at': time.time()}, merge=True)
+
+    def delete(self, key):
+        self._document(key).delete()
+
+
+_BACKENDS = {
+    'local': LocalCheckpointStore,
+    'firestore': FirestoreCheckpointStore,
+}
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_checkpoint_store():
+    """Return the process-wide checkpoint store, creating the configured backend on first use."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                if CHECKPOINT_BACKEND not in _BACKENDS:
+                    raise ValueError(f"Unknown CHECKPOINT_BACKEND: {CHECKPOINT_BACKEND}")
+                _store = _BACKENDS[CHECKPOINT_BACKEND]()
+    return _store
@@ -0,0 +1,78 @@
+# clients.py
+
+import os
+import time
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from flask import current_app
+
+# Connections kept open per pooled HTTP session
+HTTP_POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', 32))
+
+_clients = {}
+_lock = threading.Lock()
+
+
+def _get_or_create(name, factory):
+    """Return the client registered under name, building it with factory on first use."""
+    client = _clients.get(name)
+    if client is None:
+        with _lock:
+            client = _clients.get(name)
+            if client is None:
+                started = time.perf_counter()
+                client = factory()
+                _clients[name] = client
+                elapsed_ms = (time.perf_counter() - started) * 1000
+                try:
+                    current_app.logger.info(f"Initialized {name} client in {elapsed_ms:.0f} ms")
+                except RuntimeError:
+                    pass  # Outside an app context
+    return client
+
+
+def register_client(name, client):
+    """Replace a registered client, e.g. with a local stand-in."""
+    with _lock:
+        _clients[name] = client
+
+
+def get_storage_client():
+    from google.cloud import storage
+    return _get_or_create('storage', storage.Client)
+
+
+def get_bucket(bucket_name):
+    return _get_or_create(f'bucket:{bucket_name}', lambda: get_storage_client().bucket(bucket_name))
+
+
+def get_speech_client():
+    from google.cloud import speech
+    return _get_or_create('speech', speech.SpeechClient)
+
+
+def get_firestore_client():
+    from google.cloud import firestore
+    return _get_or_create('firestore', firestore.Client)
+
+
+def get_async_firestore_client():
+    """Firestore client for coroutines; it binds to the event loop that first uses it."""
+    from google.cloud import firestore
+    return _get_or_create('firestore_async', firestore.AsyncClient)
+
+
+def get_http_session(name):
+    """Shared requests session with a connection pool, one per upstream service."""
+    def create_session():
+        # youtube_utils replaces requests.Session with a subclass that skips certificate checks;
+        # these sessions carry API keys and tokens, so always use the real class
+        session = requests.sessions.Session()
+        session.verify = True
+        adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    return _get_or_create(f'http:{name}', create_session)
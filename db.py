@@ -1,12 +1,74 @@
-import requests  # Make sure to import the requests library
-from utils import load_api_key
-from google.cloud import firestore  
-
-db = firestore.Client()
+import os
+import re
+import json
+import time
+import random
+import hashlib
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import requests
+from urllib3.exceptions import NewConnectionError
+from utils import load_api_key, with_app_context
+from clients import get_firestore_client, get_http_session
+from metrics import timed
+from admission import admit, admission_timeout
 
 # Dify 知识库
 dataset_id = '5d7b8d77-ef7e-46e5-b583-be8368718d83'
 
+# Concurrent create-by-text calls for batch ingestion
+DIFY_CONCURRENCY = int(os.environ.get('DIFY_CONCURRENCY', 4))
+# Retries for rate-limited or unreachable Dify calls, with exponential backoff starting at DIFY_BACKOFF seconds
+DIFY_MAX_RETRIES = int(os.environ.get('DIFY_MAX_RETRIES', 4))
+DIFY_BACKOFF = float(os.environ.get('DIFY_BACKOFF', 1.0))
+# create-by-text is not idempotent: a 5xx or a read timeout may come after the document was created,
+# so only rate limiting is retried
+RETRY_STATUS_CODES = {429}
+# Firestore accepts at most 500 writes per batch
+FIRESTORE_BATCH_SIZE = 500
+
+# Transcript markup ignored when hashing content: "[00:12]" / "[0:00:12]" timestamps and "Speaker 1:" labels
+TRANSCRIPT_MARKUP = re.compile(r'\[\d{1,2}(?::\d{2}){1,2}\]|\bspeaker \d+:')
+
+dify_executor = ThreadPoolExecutor(max_workers=DIFY_CONCURRENCY, thread_name_prefix='dify')
+
+def request_not_sent(error):
+    """True when a request failed while connecting, so Dify never saw it and it is safe to send again."""
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(error, requests.exceptions.ConnectionError) and isinstance(reason, NewConnectionError)
+
+def post_with_retry(session, url, budget=None, **kwargs):
+    """POST with exponential backoff on rate limiting and on connection errors before the request was sent.
+
+    Waits between attempts stop once `budget` seconds (by default the caller's admission
+    timeout) have passed; the last response or error is returned then.
+    """
+    deadline = time.monotonic() + (admission_timeout() if budget is None else budget)
+    for attempt in range(DIFY_MAX_RETRIES + 1):
+        try:
+            response = session.post(url, **kwargs)
+        except Exception as e:
+            if attempt == DIFY_MAX_RETRIES or not request_not_sent(e):
+                raise
+            delay = DIFY_BACKOFF * 2 ** attempt + random.uniform(0, DIFY_BACKOFF)
+            if delay > deadline - time.monotonic():
+                raise
+        else:
+            if response.status_code not in RETRY_STATUS_CODES or attempt == DIFY_MAX_RETRIES:
+                return response
+            retry_after = response.headers.get('Retry-After', '')
+            if retry_after.isdigit():
+                delay = int(retry_after)
+            else:
+                delay = DIFY_BACKOFF * 2 ** attempt + random.uniform(0, DIFY_BACKOFF)
+            if delay > deadline - time.monotonic():
+                # Dify would not take the request again before the caller gives up
+                return response
+        time.sleep(delay)
+
 def create_document_vector(title, text):
     """Create a document in the specified dataset using the provided text."""
     api_key = load_api_key('dify_datasets_api_key')  # Load the API key
@@ -26,7 +88,8 @@ def create_document_vector(title, text):
         }
     }
     
-    response = requests.post(url, headers=headers, json=data)
+    with admit('dify'), timed('dify_index'):
+        response = post_with_retry(get_http_session('dify'), url, headers=headers, json=data, timeout=60)
     # {
     #     "document": {
     #         "id": "",
@@ -61,9 +124,104 @@ def create_document_vector(title, text):
             'error': str(response.json())
         }
     
+def content_hash(text):
+    """SHA-256 of the text after normalizing case, Unicode forms, punctuation, whitespace and transcript markup."""
+    normalized = unicodedata.normalize('NFKC', text).casefold()
+    normalized = TRANSCRIPT_MARKUP.sub(' ', normalized)
+    normalized = ' '.join(re.sub(r'[^\w\s]', ' ', normalized).split())
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+def find_document_by_hash(hash_value, user_id):
+    """Return (id, data) of this user's article with this content hash, or None."""
+    query = (
+        get_firestore_client().collection('articles')
+        .where('content_hash', '==', hash_value)
+        .where('user_id', '==', user_id)
+        .limit(1)
+    )
+    for doc in query.stream():
+        return doc.id, doc.to_dict()
+    return None
+
+def find_vector_id_by_hash(hash_value):
+    """Return the Dify vector_id already indexed for this content by any user, or None.
+
+    Only the vector is shared between users; each user still gets their own article.
+    """
+    query = get_firestore_client().collection('articles').where('content_hash', '==', hash_value).limit(1)
+    for doc in query.stream():
+        return doc.to_dict().get('vector_id')
+    return None
+
+def build_document(data):
+    """Build the document to store from request fields. Returns (document, error)."""
+    content = data.get('content')  # Extract the "text" field
+    title = data.get('title')  # Extract the "text" field
+    llm_processed = data.get('llm_processed', '')
+    metadata = data.get('metadata', {})  # Use an empty dict if metadata is not provided
+    if isinstance(metadata, str):
+        try:
+            metadata = json.loads(metadata)  # Attempt to parse the JSON string into a dictionary
+        except json.JSONDecodeError:
+            pass  # Keep metadata as is if parsing fails
+    user_id = data.get('user_id', 0)
+
+    if not content:
+        return None, 'Content is required'
+
+    if not title:
+        return None, 'Title is required'
+
+    return {
+        "title": title,
+        "user_id": user_id,
+        "content": content,
+        "metadata": metadata,
+        "llm_processed": llm_processed,
+        "content_hash": content_hash(content),
+        "timestamp": datetime.now()
+    }, None
+
 def create_document_db(document_data):
     """Save the document data to Firestore."""
     # Assuming you want to save the document under a collection named 'documents'
-    write_time, doc_ref = db.collection('articles').add(document_data)
+    with timed('firestore_write'):
+        write_time, doc_ref = get_firestore_client().collection('articles').add(document_data)
 
     return doc_ref.id # { 'id', 'path' }
+
+
+def create_documents_vectors(documents):
+    """Create Dify documents for many (title, text) pairs concurrently. Results keep the input order."""
+    def create(item):
+        title, text = item
+        try:
+            return create_document_vector(title, text)
+        except Exception as e:
+            return {'error': str(e)}
+
+    return list(dify_executor.map(with_app_context(create), documents))
+
+def create_documents_db(documents):
+    """Save many documents to Firestore with batched writes.
+
+    Returns one entry per document in input order: the document ID, or an {'error'} dict
+    when the batch holding it failed to commit.
+    """
+    client = get_firestore_client()
+    collection = client.collection('articles')
+    ids = []
+    for i in range(0, len(documents), FIRESTORE_BATCH_SIZE):
+        batch = client.batch()
+        chunk_ids = []
+        for document_data in documents[i:i + FIRESTORE_BATCH_SIZE]:
+            doc_ref = collection.document()  # Auto-generated ID, same as add()
+            batch.set(doc_ref, document_data)
+            chunk_ids.append(doc_ref.id)
+        try:
+            with timed('firestore_write'):
+                batch.commit()
+            ids.extend(chunk_ids)
+        except Exception as e:
+            ids.extend({'error': str(e)} for _ in chunk_ids)
+    return ids
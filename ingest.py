@@ -0,0 +1,298 @@
+# ingest.py
+
+import os
+import time
+import uuid
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+import yt_dlp
+import db
+from youtube_utils import get_video_id, get_youtube_videos_metadata, get_youtube_transcript, YOUTUBE_MAX_IDS_PER_REQUEST
+from pipeline import transcribe_from_audio
+from utils import with_app_context
+from admission import PRIORITY_BACKGROUND, priority
+from metrics import timed
+
+# Videos enumerated per playlist or channel at most
+INGEST_MAX_VIDEOS = int(os.environ.get('INGEST_MAX_VIDEOS', 5000))
+# Concurrency of each pipeline stage, shared by all runs; the audio stage is the slow one
+INGEST_LIST_WORKERS = int(os.environ.get('INGEST_LIST_WORKERS', 2))
+INGEST_METADATA_WORKERS = int(os.environ.get('INGEST_METADATA_WORKERS', 2))
+INGEST_CAPTION_WORKERS = int(os.environ.get('INGEST_CAPTION_WORKERS', 8))
+INGEST_AUDIO_WORKERS = int(os.environ.get('INGEST_AUDIO_WORKERS', 2))
+INGEST_INDEX_WORKERS = int(os.environ.get('INGEST_INDEX_WORKERS', 4))
+# Finished runs are forgotten after this many seconds
+INGEST_RETENTION = int(os.environ.get('INGEST_RETENTION', 24 * 60 * 60))
+
+list_executor = ThreadPoolExecutor(max_workers=INGEST_LIST_WORKERS, thread_name_prefix='ingest-list')
+metadata_executor = ThreadPoolExecutor(max_workers=INGEST_METADATA_WORKERS, thread_name_prefix='ingest-metadata')
+caption_executor = ThreadPoolExecutor(max_workers=INGEST_CAPTION_WORKERS, thread_name_prefix='ingest-captions')
+audio_executor = ThreadPoolExecutor(max_workers=INGEST_AUDIO_WORKERS, thread_name_prefix='ingest-audio')
+index_executor = ThreadPoolExecutor(max_workers=INGEST_INDEX_WORKERS, thread_name_prefix='ingest-index')
+
+
+def list_video_urls(url, limit=INGEST_MAX_VIDEOS):
+    """用 yt-dlp 的 flat 提取列出播放列表或频道中的视频 URL，不下载任何内容。"""
+    ydl_opts = {
+        'extract_flat': 'in_playlist',
+        'skip_download': True,
+        'playlistend': limit,
+        'quiet': True
+    }
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        with timed('list'):
+            info = ydl.extract_info(url, download=False)
+
+    urls = []
+
+    def collect(entries):
+        for entry in entries or []:
+            if len(urls) >= limit:
+                return
+            if entry.get('entries') is not None:
+                # Channels nest their tabs (videos, shorts, live) as playlists
+                collect(entry['entries'])
+            elif entry.get('ie_key') in (None, 'Youtube') and entry.get('id'):
+                urls.append(f"https://www.youtube.com/watch?v={entry['id']}")
+
+    if info.get('entries') is None:
+        # A single video URL
+        if info.get('id'):
+            urls.append(f"https://www.youtube.com/watch?v={info['id']}")
+    else:
+        collect(info['entries'])
+    return list(dict.fromkeys(urls))
+
+
+class IngestItem:
+    def __init__(self, video_url):
+        self.video_url = video_url
+        self.status = 'queued'  # queued, running, succeeded, skipped, failed
+        self.stage = None
+        self.source = None  # captions or audio
+        self.title = None
+        self.db_id = None
+        self.vector_id = None
+        self.duplicate = False
+        self.error = None
+
+    def to_dict(self):
+        return {
+            "url": self.video_url,
+            "status": self.status,
+            "stage": self.stage,
+            "source": self.source,
+            "title": self.title,
+            "db_id": self.db_id,
+            "vector_id": self.vector_id,
+            "duplicate": self.duplicate,
+            "error": self.error
+        }
+
+
+class IngestRun:
+    def __init__(self, source_url, language_code, audio_fallback=True, force=False, limit=INGEST_MAX_VIDEOS):
+        self.id = uuid.uuid4().hex
+        self.source_url = source_url
+        self.language_code = language_code
+        self.audio_fallback = audio_fallback
+        self.force = force
+        self.limit = limit
+        self.status = 'listing'  # listing, running, succeeded, failed
+        self.items = []
+        self.error = None
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        self._remaining = 0
+        self._lock = threading.Lock()
+
+    def to_dict(self, include_items=True):
+        counts = {}
+        stages = {}
+        with self._lock:
+            for item in self.items:
+                counts[item.status] = counts.get(item.status, 0) + 1
+                if item.status == 'running':
+                    stages[item.stage] = stages.get(item.stage, 0) + 1
+            result = {
+                "id": self.id,
+                "url": self.source_url,
+                "lang": self.language_code,
+                "status": self.status,
+                "total": len(self.items),
+                "counts": counts,
+                "running_stages": stages,
+                "error": self.error,
+                "created_at": self.created_at,
+                "updated_at": self.updated_at
+            }
+            if include_items:
+                result["items"] = [item.to_dict() for item in self.items]
+        return result
+
+    def advance(self, item, stage):
+        with self._lock:
+            item.status = 'running'
+            item.stage = stage
+            self.updated_at = time.time()
+
+    def finish(self, item, status, error=None):
+        with self._lock:
+            item.status = status
+            item.error = error
+            self._remaining -= 1
+            self.updated_at = time.time()
+            if self._remaining == 0 and self.status == 'running':
+                self.status = 'succeeded'
+
+
+class IngestManager:
+    """Runs playlist and channel ingestion as a pipeline of bounded stages.
+
+    Each video moves metadata -> captions -> (audio) -> index on its own, so videos with
+    captions are indexed while slow audio transcriptions are still running.
+    """
+
+    def __init__(self):
+        self._runs = {}
+        self._lock = threading.Lock()
+
+    def start(self, source_url, language_code, audio_fallback=True, force=False, limit=INGEST_MAX_VIDEOS):
+        run = IngestRun(source_url, language_code, audio_fallback, force, limit)
+        with self._lock:
+            self._prune()
+            self._runs[run.id] = run
+        # Nobody waits on ingestion, so its stages yield shared resources to interactive requests
+        with priority(PRIORITY_BACKGROUND):
+            list_executor.submit(with_app_context(self._list), run)
+        return run
+
+    def get(self, run_id):
+        with self._lock:
+            return self._runs.get(run_id)
+
+    def _prune(self):
+        cutoff = time.time() - INGEST_RETENTION
+        expired = [
+            run_id for run_id, run in self._runs.items()
+            if run.status in ('succeeded', 'failed') and run.updated_at < cutoff
+        ]
+        for run_id in expired:
+            del self._runs[run_id]
+
+    def _list(self, run):
+        try:
+            urls = list_video_urls(run.source_url, run.limit)
+        except Exception as e:
+            current_app.logger.error(f"Ingest {run.id}: listing {run.source_url} failed: {str(e)}")
+            with run._lock:
+                run.error = {"error": str(e), "traceback": traceback.format_exc()}
+                run.status = 'failed'
+                run.updated_at = time.time()
+            return
+
+        current_app.logger.info(f"Ingest {run.id}: {len(urls)} videos in {run.source_url}")
+        items = [IngestItem(url) for url in urls]
+        with run._lock:
+            run.items = items
+            run._remaining = len(items)
+            run.status = 'running' if items else 'succeeded'
+            run.updated_at = time.time()
+
+        # videos.list takes up to 50 IDs, so metadata is fetched per chunk
+        for i in range(0, len(items), YOUTUBE_MAX_IDS_PER_REQUEST):
+            metadata_executor.submit(with_app_context(self._metadata), run, items[i:i + YOUTUBE_MAX_IDS_PER_REQUEST])
+
+    def _metadata(self, run, items):
+        for item in items:
+            run.advance(item, 'metadata')
+        try:
+            # Failed lookups come back as {'error': ...} entries
+            metadata = get_youtube_videos_metadata([get_video_id(item.video_url) for item in items])
+        except Exception as e:
+            current_app.logger.error(f"Ingest {run.id}: metadata for {len(items)} videos failed: {str(e)}")
+            for item in items:
+                run.finish(item, 'failed', str(e))
+            return
+        for item in items:
+            video_metadata = metadata[get_video_id(item.video_url)]
+            if 'error' in video_metadata:
+                run.finish(item, 'failed', video_metadata['error'])
+                continue
+            item.title = video_metadata['title']
+            caption_executor.submit(with_app_context(self._captions), run, item, video_metadata)
+
+    def _captions(self, run, item, metadata):
+        run.advance(item, 'captions')
+        try:
+            captions = get_youtube_transcript(item.video_url)
+        except Exception as e:
+            current_app.logger.error(f"Ingest {run.id}: captions for {item.video_url} failed: {str(e)}")
+            run.finish(item, 'failed', str(e))
+            return
+        if 'error' not in captions:
+            item.source = 'captions'
+            index_executor.submit(with_app_context(self._index), run, item, metadata, captions['formatted_transcript'])
+        elif run.audio_fallback:
+            run.advance(item, 'audio_queued')
+            audio_executor.submit(with_app_context(self._audio), run, item, metadata)
+        else:
+            run.finish(item, 'skipped', captions['error'])
+
+    def _audio(self, run, item, metadata):
+        run.advance(item, 'audio')
+        try:
+            result = transcribe_from_audio(item.video_url, run.language_code)
+        except Exception as e:
+            current_app.logger.error(f"Ingest {run.id}: audio for {item.video_url} failed: {str(e)}")
+            run.finish(item, 'failed', str(e))
+            return
+        item.source = 'audio'
+        index_executor.submit(with_app_context(self._index), run, item, metadata, result['formatted_transcript'])
+
+    def _index(self, run, item, metadata, transcript):
+        run.advance(item, 'index')
+        try:
+            document, error = db.build_document({
+                'title': metadata['title'],
+                'content': transcript,
+                'metadata': {
+                    'video_url': item.video_url,
+                    'channel_title': metadata['channel_title'],
+                    'published_at': metadata['published_at'],
+                    'source': item.source,
+                    'ingest_id': run.id
+                }
+            })
+            if error:
+                run.finish(item, 'failed', error)
+                return
+
+            vector_id = None
+            if not run.force:
+                existing = db.find_document_by_hash(document['content_hash'], document['user_id'])
+                if existing is not None:
+                    item.db_id, stored = existing
+                    item.vector_id = stored.get('vector_id')
+                    item.duplicate = True
+                    run.finish(item, 'succeeded')
+                    return
+                vector_id = db.find_vector_id_by_hash(document['content_hash'])
+
+            if vector_id is None:
+                document_vector = db.create_document_vector(document['title'], document['content'])
+                if 'error' in document_vector:
+                    run.finish(item, 'failed', str(document_vector))
+                    return
+                vector_id = document_vector['document']['id']
+            item.vector_id = document['vector_id'] = vector_id
+            item.db_id = db.create_document_db(document)
+            run.finish(item, 'succeeded')
+        except Exception as e:
+            current_app.logger.error(f"Ingest {run.id}: indexing {item.video_url} failed: {str(e)}")
+            run.finish(item, 'failed', str(e))
+
+
+ingest_manager = IngestManager()
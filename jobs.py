@@ -0,0 +1,135 @@
+# jobs.py
+
+import os
+import math
+import time
+import uuid
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from pipeline import transcribe_video
+from clients import get_http_session
+from admission import PRIORITY_BACKGROUND, Overloaded, priority
+
+# Worker threads that run the download -> upload -> recognize -> format pipeline
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 4))
+# Jobs allowed to wait for a free worker before new submissions are rejected
+JOB_QUEUE_SIZE = int(os.environ.get('JOB_QUEUE_SIZE', 100))
+# Finished jobs are forgotten after this many seconds
+JOB_RETENTION = int(os.environ.get('JOB_RETENTION', 24 * 60 * 60))
+
+
+class JobQueueFull(Overloaded):
+    """Raised when the job queue has no room for another job."""
+
+
+class Job:
+    def __init__(self, video_url, language_code, callback_url=None):
+        self.id = uuid.uuid4().hex
+        self.video_url = video_url
+        self.language_code = language_code
+        self.callback_url = callback_url
+        self.status = 'queued'  # queued, running, succeeded, failed
+        self.stage = None
+        self.progress = None
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+
+    def update(self, stage, progress=None):
+        self.stage = stage
+        self.progress = progress
+        self.updated_at = time.time()
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "url": self.video_url,
+            "lang": self.language_code,
+            "status": self.status,
+            "stage": self.stage,
+            "progress": self.progress,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at
+        }
+
+
+class JobManager:
+    """Runs transcription jobs on a bounded worker pool, off the request thread."""
+
+    def __init__(self, max_workers=JOB_WORKERS, max_queued=JOB_QUEUE_SIZE):
+        self.max_workers = max_workers
+        self.max_pending = max_workers + max_queued
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self._jobs = {}
+        self._pending = 0
+        # Moving average of how long a job runs, used for Retry-After
+        self._average_duration = 60.0
+        self._lock = threading.Lock()
+
+    def submit(self, video_url, language_code, callback_url=None):
+        app = current_app._get_current_object()
+        job = Job(video_url, language_code, callback_url)
+        with self._lock:
+            self._prune()
+            if self._pending >= self.max_pending:
+                raise JobQueueFull('jobs', self._retry_after())
+            self._pending += 1
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, app, job)
+        return job
+
+    def _retry_after(self):
+        """Seconds until a queued job is likely to have started, for the Retry-After header."""
+        queued = self._pending - self.max_workers + 1
+        return max(1, math.ceil(self._average_duration * queued / self.max_workers))
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _prune(self):
+        cutoff = time.time() - JOB_RETENTION
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.status in ('succeeded', 'failed') and job.updated_at < cutoff
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def _run(self, app, job):
+        # Jobs yield shared resources to requests that have a client waiting
+        with app.app_context(), priority(PRIORITY_BACKGROUND):
+            job.status = 'running'
+            started = time.monotonic()
+            try:
+                job.result = transcribe_video(job.video_url, job.language_code, on_stage=job.update)
+                job.status = 'succeeded'
+                job.update('done', 100)
+            except Exception as e:
+                current_app.logger.error(f"Job {job.id} failed: {str(e)}")
+                job.error = {
+                    "error": str(e),
+                    "traceback": traceback.format_exc()
+                }
+                job.status = 'failed'
+                job.update(job.stage, job.progress)
+            finally:
+                with self._lock:
+                    self._pending -= 1
+                    self._average_duration = 0.8 * self._average_duration + 0.2 * (time.monotonic() - started)
+            if job.callback_url:
+                self._notify(job)
+
+    def _notify(self, job):
+        try:
+            get_http_session('callbacks').post(job.callback_url, json=job.to_dict(), timeout=10)
+        except Exception as e:
+            current_app.logger.error(f"Callback for job {job.id} to {job.callback_url} failed: {str(e)}")
+
+
+job_manager = JobManager()
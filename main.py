@@ -1,24 +1,109 @@
+import time
+IMPORT_STARTED = time.perf_counter()  # Measure cold start from the first line of the module
+
 import os
 import json
-from flask import Flask, request, current_app, jsonify
-from google.cloud import storage
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, Response, request, current_app, jsonify, g
 import traceback
-from youtube_utils import get_youtube_video_metadata, download_audio, transcribe_audio_with_diarization, test_gcs_connection, get_youtube_transcript
+from youtube_utils import get_youtube_video_metadata, get_youtube_videos_metadata, download_audio, test_gcs_connection, get_youtube_transcript, get_video_id
 import db
-from datetime import datetime
+from pipeline import transcribe_from_audio, transcribe_video, should_speculate, load_transcript_store, download_audio_shared
+from jobs import job_manager, JobQueueFull
+from ingest import ingest_manager, INGEST_MAX_VIDEOS
+from streaming import stream_mode, stream_transcription
+from utils import with_app_context
+from metrics import REQUEST_TIMING_LOGS, request_duration, render, transcript_sources
+from admission import Overloaded, PRIORITY_BATCH, priority
+from singleflight import SingleFlight
 
 
 app = Flask(__name__)
 
-BUCKET_NAME = 'keith_speech_to_text'
-storage_client = storage.Client()
-bucket = storage_client.bucket(BUCKET_NAME)
+# Shared pool for the independent network calls made by a single request
+FANOUT_WORKERS = int(os.environ.get('FANOUT_WORKERS', 16))
+fanout_executor = ThreadPoolExecutor(max_workers=FANOUT_WORKERS, thread_name_prefix='fanout')
+# Start the yt-dlp audio download alongside the caption lookup unless the request says otherwise
+SPECULATIVE_AUDIO = os.environ.get('SPECULATIVE_AUDIO', '0') == '1'
+# Speculative downloads take minutes, so they get their own pool instead of blocking the fast lookups above
+SPECULATIVE_WORKERS = int(os.environ.get('SPECULATIVE_WORKERS', 4))
+speculative_executor = ThreadPoolExecutor(max_workers=SPECULATIVE_WORKERS, thread_name_prefix='speculative')
+
+# Batch endpoints: maximum URLs per request and parallel caption fetches
+BATCH_MAX_URLS = int(os.environ.get('BATCH_MAX_URLS', 1000))
+BATCH_CAPTION_WORKERS = int(os.environ.get('BATCH_CAPTION_WORKERS', 8))
+batch_executor = ThreadPoolExecutor(max_workers=BATCH_CAPTION_WORKERS, thread_name_prefix='batch')
+
+# Identical documents submitted at the same time are indexed once
+document_flight = SingleFlight()
+
+# "async" serves the HTTP-bound endpoints from an aiohttp event loop (see async_app.py)
+SERVING_MODE = os.environ.get('SERVING_MODE', 'sync')
 
 # Print all environment variables when the app starts
 print("Starting Flask App with the following environment variables:")
 for key, value in os.environ.items():
     print(f"{key}: {value}")
 
+# Cold-start measurements: module import time and the first request served by this process
+startup_timing = {
+    "import_seconds": None,
+    "first_request_seconds": None,
+    "first_response_since_import_seconds": None
+}
+
+@app.before_request
+def mark_request_start():
+    g.request_started = time.perf_counter()
+    g.stage_timings = []
+
+@app.after_request
+def record_first_request(response):
+    if startup_timing["first_request_seconds"] is None and 'request_started' in g:
+        now = time.perf_counter()
+        startup_timing["first_request_seconds"] = round(now - g.request_started, 3)
+        startup_timing["first_response_since_import_seconds"] = round(now - IMPORT_STARTED, 3)
+        current_app.logger.info(f"First request served: {startup_timing}")
+    return response
+
+@app.after_request
+def record_request_timing(response):
+    if 'request_started' not in g:
+        return response
+    elapsed = time.perf_counter() - g.request_started
+    # Label by route rule rather than raw path so the number of series stays bounded
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    request_duration.observe(elapsed, endpoint=endpoint, status=response.status_code)
+    if REQUEST_TIMING_LOGS:
+        current_app.logger.info(json.dumps({
+            "method": request.method,
+            "path": request.path,
+            "status": response.status_code,
+            "total_ms": round(elapsed * 1000, 1),
+            "stages": g.stage_timings
+        }))
+    return response
+
+def overloaded_response(error):
+    """资源已满时返回 429，并告诉客户端多久后重试。"""
+    current_app.logger.warning(f"Rejected request to {request.path}: {str(error)}")
+    return {"error": str(error)}, 429, {"Retry-After": str(error.retry_after)}
+
+@app.errorhandler(Overloaded)
+def handle_overloaded(error):
+    return overloaded_response(error)
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """以 Prometheus 文本格式导出各阶段耗时、缓存命中率等指标。"""
+    return Response(render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/startup-timing', methods=['GET'])
+def startup_timing_endpoint():
+    """返回本进程的冷启动耗时。"""
+    return startup_timing
+
 @app.route('/audio-file', methods=['GET'])
 def audio_file_endpoint():
     """下载音频的端点，从视频 URL 返回签名 URL 和转录文本。"""
@@ -34,43 +119,57 @@ def download_audio_endpoint():
     """下载音频的端点，从视频 URL 返回转录文本和其他视频信息。"""
     video_url = request.args.get('url')
     language_code = request.args.get('lang', 'en-US')  # en-US, zh-CN
+    speculative = request.args.get('speculative', '1' if SPECULATIVE_AUDIO else '0') in ('1', 'true')
     
     if not video_url:
         return {"error": "No URL provided"}, 400
+
+    # Accept: application/x-ndjson or text/event-stream opts into progressive output
+    mode = stream_mode()
+    if mode:
+        return stream_transcription(video_url, language_code, mode)
     
     try:
-        metadata = get_youtube_video_metadata(video_url)
-        transcription_result = get_youtube_transcript(video_url)
+        # Metadata and caption lookups are independent, so run them concurrently
+        metadata_future = fanout_executor.submit(with_app_context(get_youtube_video_metadata), video_url)
+        transcript_future = fanout_executor.submit(with_app_context(get_youtube_transcript), video_url)
+
+        audio_future = None
+        cancel_event = threading.Event()
+        if speculative and should_speculate(video_url, language_code):
+            current_app.logger.info("Speculatively downloading audio")
+            audio_future = speculative_executor.submit(with_app_context(download_audio_shared), video_url, cancel_event=cancel_event)
+
+        transcription_result = transcript_future.result()
 
         signed_url = ""
         gcs_uri = ""
         
         if 'error' in transcription_result:
-            current_app.logger.info("Transcribing from audio")
-            signed_url = download_audio(video_url)
-            # Extract the blob name from the signed URL
-            blob_name = signed_url.split('/')[-1].split('?')[0]
-            gcs_uri = f'gs://{BUCKET_NAME}/audio/{blob_name}'
-            
-            # Generate transcription
-            transcription_result = transcribe_audio_with_diarization(gcs_uri)
+            speculative_url = audio_future.result() if audio_future else None
+            transcription_result = transcribe_from_audio(video_url, language_code, signed_url=speculative_url)
+            signed_url = transcription_result['download_url']
+            gcs_uri = transcription_result['gcs_uri']
         else:
             current_app.logger.info("Found native transcripts")
+            transcript_sources.inc(source='captions')
+            if audio_future:
+                # Captions arrived, so the speculative download is no longer needed
+                cancel_event.set()
+                audio_future.cancel()
+
+        metadata = metadata_future.result()
             
         return {
             "download_url": signed_url,
             "gcs_uri": gcs_uri,
             "formatted_transcript": transcription_result['formatted_transcript'],
             # "raw_transcript": transcription_result['raw_transcript'],
-            "title": metadata['title'],
-            "description": metadata['description'],
-            "thumbnails": metadata['thumbnails'],
-            "channel_title": metadata['channel_title'],
-            "published_at": metadata['published_at'],
-            "tags": metadata['tags'],
-            "language": metadata['language']
+            **video_metadata_fields(metadata)
         }
     
+    except Overloaded as e:
+        return overloaded_response(e)
     except Exception as e:
         current_app.logger.error(f"Endpoint error: {str(e)}")
         return {
@@ -78,6 +177,80 @@ def download_audio_endpoint():
             "traceback": traceback.format_exc()
         }, 500
 
+def video_metadata_fields(metadata):
+    """/v 响应中包含的元数据字段。"""
+    return {
+        "title": metadata['title'],
+        "description": metadata['description'],
+        "thumbnails": metadata['thumbnails'],
+        "channel_title": metadata['channel_title'],
+        "published_at": metadata['published_at'],
+        "tags": metadata['tags'],
+        "language": metadata['language']
+    }
+
+def read_batch_urls():
+    """从 JSON 请求体读取 URL 列表，返回 (urls, error_response)。"""
+    data = request.get_json(silent=True) or {}
+    urls = data.get('urls')
+    if not isinstance(urls, list) or not urls:
+        return None, ({"error": "No URLs provided"}, 400)
+    if len(urls) > BATCH_MAX_URLS:
+        return None, ({"error": f"At most {BATCH_MAX_URLS} URLs per batch"}, 400)
+    invalid = [index for index, url in enumerate(urls) if not isinstance(url, str)]
+    if invalid:
+        return None, ({"error": "Every URL must be a string", "invalid_indexes": invalid}, 400)
+    return urls, None
+
+def batch_metadata(urls):
+    """按 50 个 ID 一组查询元数据，返回 {url: metadata}。"""
+    video_ids = {url: get_video_id(url) for url in urls}
+    metadata = get_youtube_videos_metadata([video_id for video_id in video_ids.values() if video_id])
+    return {
+        url: metadata[video_id] if video_id else {'error': 'Invalid YouTube URL'}
+        for url, video_id in video_ids.items()
+    }
+
+@app.route('/v/batch', methods=['POST'])
+def batch_endpoint():
+    """批量返回多个视频的元数据和官方字幕，可选地为没有字幕的视频提交后台转录任务。"""
+    urls, error = read_batch_urls()
+    if error:
+        return error
+    data = request.get_json(silent=True) or {}
+    language_code = data.get('lang', 'en-US')
+    audio_fallback = bool(data.get('audio_fallback', False))
+
+    metadata_by_url = batch_metadata(urls)
+    # Only fetch captions for videos that exist, with bounded parallelism
+    caption_urls = [url for url in dict.fromkeys(urls) if 'error' not in metadata_by_url[url]]
+    fetch_transcript = with_app_context(get_youtube_transcript)
+    captions_by_url = dict(zip(caption_urls, batch_executor.map(fetch_transcript, caption_urls)))
+
+    results = []
+    for url in urls:
+        metadata = metadata_by_url[url]
+        if 'error' in metadata:
+            results.append({"url": url, "error": metadata['error']})
+            continue
+
+        result = {"url": url, **video_metadata_fields(metadata)}
+        captions = captions_by_url[url]
+        if 'error' not in captions:
+            transcript_sources.inc(source='captions')
+            result["formatted_transcript"] = captions['formatted_transcript']
+        elif audio_fallback:
+            try:
+                result["job_id"] = job_manager.submit(url, language_code).id
+            except JobQueueFull as e:
+                result["error"] = "Job queue is full, retry later"
+                result["retry_after"] = e.retry_after
+        else:
+            result["error"] = captions['error']
+        results.append(result)
+
+    return {"results": results}
+
 @app.route('/test-connection', methods=['GET'])
 def test_connection_endpoint():
     """测试与 Google Cloud Storage 的连接的端点。"""
@@ -98,35 +271,27 @@ def test_connection_endpoint():
 def transcribe_endpoint():
     """从视频 URL 返回官方字幕或转录文本"""
     video_url = request.args.get('url')
+    language_code = request.args.get('lang', 'en-US')
     
     if not video_url:
         return {"error": "No URL provided"}, 400
+
+    mode = stream_mode()
+    if mode:
+        return stream_transcription(video_url, language_code, mode, include_metadata=False)
     
     try:
-        transcription_result = get_youtube_transcript(video_url)
-
-        signed_url = ""
-        gcs_uri = ""
-        
-        if 'error' in transcription_result:
-            current_app.logger.info("Transcribing from audio")
-            signed_url = download_audio(video_url)
-            # Extract the blob name from the signed URL
-            blob_name = signed_url.split('/')[-1].split('?')[0]
-            gcs_uri = f'gs://{BUCKET_NAME}/audio/{blob_name}'
-            
-            # Generate transcription
-            transcription_result = transcribe_audio_with_diarization(gcs_uri)
-        else:
-            current_app.logger.info("Found native transcripts")
+        transcription_result = transcribe_video(video_url, language_code)
             
         return {
-            "download_url": signed_url,
-            "gcs_uri": gcs_uri,
+            "download_url": transcription_result['download_url'],
+            "gcs_uri": transcription_result['gcs_uri'],
             "formatted_transcript": transcription_result['formatted_transcript'],
             # "raw_transcript": transcription_result['raw_transcript'],
         }
     
+    except Overloaded as e:
+        return overloaded_response(e)
     except Exception as e:
         current_app.logger.error(f"Endpoint error: {str(e)}")
         return {
@@ -135,6 +300,62 @@ def transcribe_endpoint():
         }, 500
 
 
+@app.route('/jobs', methods=['POST'])
+def create_job_endpoint():
+    """提交后台转录任务，立即返回任务 ID。"""
+    data = request.get_json(silent=True) or request.form
+    video_url = data.get('url')
+    language_code = data.get('lang', 'en-US')
+    callback_url = data.get('callback_url')
+
+    if not video_url:
+        return {"error": "No URL provided"}, 400
+
+    try:
+        job = job_manager.submit(video_url, language_code, callback_url)
+    except JobQueueFull as e:
+        return overloaded_response(e)
+
+    return job.to_dict(), 202
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job_endpoint(job_id):
+    """查询后台转录任务的阶段、进度和结果。"""
+    job = job_manager.get(job_id)
+    if job is None:
+        return {"error": "Job not found"}, 404
+    return job.to_dict()
+
+@app.route('/ingest', methods=['POST'])
+def create_ingest_endpoint():
+    """导入整个播放列表或频道：列出视频后逐个经过元数据、字幕（或音频）和索引阶段。"""
+    data = request.get_json(silent=True) or request.form
+    source_url = data.get('url')
+    language_code = data.get('lang', 'en-US')
+    # audio=0 skips videos without captions instead of transcribing their audio
+    audio_fallback = str(data.get('audio', '1')) in ('1', 'true')
+    force = str(data.get('force', '0')) in ('1', 'true')
+
+    if not source_url:
+        return {"error": "No URL provided"}, 400
+    try:
+        limit = min(int(data.get('limit', INGEST_MAX_VIDEOS)), INGEST_MAX_VIDEOS)
+    except ValueError:
+        return {"error": "limit must be an integer"}, 400
+    if limit < 1:
+        return {"error": "limit must be positive"}, 400
+
+    run = ingest_manager.start(source_url, language_code, audio_fallback, force, limit)
+    return run.to_dict(), 202
+
+@app.route('/ingest/<run_id>', methods=['GET'])
+def get_ingest_endpoint(run_id):
+    """查询导入任务的进度；items=0 时只返回汇总。"""
+    run = ingest_manager.get(run_id)
+    if run is None:
+        return {"error": "Ingest run not found"}, 404
+    return run.to_dict(include_items=request.args.get('items', '1') != '0')
+
 @app.route('/video-metadata', methods=['GET'])
 def video_metadata_endpoint():
     """获取 YouTube 视频的元数据。"""
@@ -146,6 +367,57 @@ def video_metadata_endpoint():
     metadata = get_youtube_video_metadata(video_url)
     return metadata
 
+@app.route('/video-metadata/batch', methods=['POST'])
+def video_metadata_batch_endpoint():
+    """批量获取 YouTube 视频的元数据。"""
+    urls, error = read_batch_urls()
+    if error:
+        return error
+
+    metadata_by_url = batch_metadata(urls)
+    return {"results": [{"url": url, **metadata_by_url[url]} for url in urls]}
+
+@app.route('/transcript', methods=['GET'])
+def transcript_range_endpoint():
+    """按时间范围返回转录片段，支持 json、srt、vtt 和 text 格式。"""
+    video_url = request.args.get('url')
+    language_code = request.args.get('lang', 'en-US')
+    output_format = request.args.get('format', 'json')
+    level = request.args.get('level', 'segments')
+
+    if not video_url:
+        return {"error": "No URL provided"}, 400
+    if output_format not in ('json', 'srt', 'vtt', 'text'):
+        return {"error": f"Unsupported format: {output_format}"}, 400
+    if level not in ('segments', 'words'):
+        return {"error": f"Unsupported level: {level}"}, 400
+    try:
+        start = float(request.args['start']) if 'start' in request.args else None
+        end = float(request.args['end']) if 'end' in request.args else None
+    except ValueError:
+        return {"error": "start and end must be numbers of seconds"}, 400
+
+    try:
+        store = load_transcript_store(video_url, language_code, level)
+    except Overloaded as e:
+        return overloaded_response(e)
+    except Exception as e:
+        current_app.logger.error(f"Endpoint error: {str(e)}")
+        return {
+            "error": str(e),
+            "traceback": traceback.format_exc()
+        }, 500
+    if store is None:
+        return {"error": "Transcript not available"}, 404
+
+    if output_format == 'srt':
+        return Response(store.to_srt(start, end), mimetype='application/x-subrip')
+    if output_format == 'vtt':
+        return Response(store.to_vtt(start, end), mimetype='text/vtt')
+    if output_format == 'text':
+        return Response(store.to_text(start, end), mimetype='text/plain')
+    return {"segments": store.segments(start, end)}
+
 @app.route('/video-transcript', methods=['GET'])
 def video_transcript_endpoint():
     """获取 YouTube 视频的转录文本。"""
@@ -157,49 +429,104 @@ def create_document_endpoint():
     """Endpoint to create a document vector from the provided text."""
     # Extract "text" from the POST body
     data = request.form  # Get the JSON data from the request
-    content = data.get('content')  # Extract the "text" field
-    title = data.get('title')  # Extract the "text" field
-    llm_processed = data.get('llm_processed', '')
-    metadata = data.get('metadata', {})  # Use an empty dict if metadata is not provided
-    if isinstance(metadata, str):
-        try:
-            metadata = json.loads(metadata)  # Attempt to parse the JSON string into a dictionary
-        except json.JSONDecodeError:
-            pass  # Keep metadata as is if parsing fails
-    user_id = data.get('user_id', 0)
-
-    if not content:
-        return {'error': 'Content is required'}, 400 
-
-    if not title:
-        return {'error': 'Title is required'}, 400 
-
-    document = {
-        "title": title,
-        "user_id": user_id,
-        "content": content,
-        "metadata": metadata,
-        "llm_processed": llm_processed,
-        "timestamp": datetime.now()
-    }
-    # Call the create_document_vector function with the extracted text
-    document_vector = db.create_document_vector(title, content)
-    vector_id = document_vector['document']['id']
-    # Check for errors in the response
-    if 'error' in document_vector:
-        return {
-                "error": str(document_vector),
-                "traceback": traceback.format_exc()
-            }, 500
+    document, error = db.build_document(data)
+    if error:
+        return {'error': error}, 400 
+
+    # force=1 indexes the content again even if it was ingested before
+    force = data.get('force', '0') in ('1', 'true')
+    # Deduplication is per user, so only the same user's identical submissions are coalesced
+    key = f"{document['user_id']}:{document['content_hash']}"
+    return document_flight.do(key, create_document, document, force)
+
+def create_document(document, force):
+    """索引并保存文档；同一用户内容相同的文档已存在时直接返回它的 db_id 和 vector_id。"""
+    vector_id = None
+    if not force:
+        existing = db.find_document_by_hash(document['content_hash'], document['user_id'])
+        if existing is not None:
+            db_id, stored = existing
+            current_app.logger.info(f'Duplicate of {db_id}, skipping indexing')
+            return {
+                "document": stored,
+                "db_id": db_id,
+                "vector_id": stored.get('vector_id'),
+                "duplicate": True
+            }
+        # Another user indexed the same content: reuse its vector, but store this user's own article
+        vector_id = db.find_vector_id_by_hash(document['content_hash'])
+
+    if vector_id is None:
+        title = document['title']
+        content = document['content']
+        # Call the create_document_vector function with the extracted text
+        document_vector = db.create_document_vector(title, content)
+        # Check for errors in the response
+        if 'error' in document_vector:
+            return {
+                    "error": str(document_vector),
+                    "traceback": traceback.format_exc()
+                }, 500
+        vector_id = document_vector['document']['id']
     current_app.logger.info(f'Vector ID: {vector_id}')
+    # Stored with the document so a duplicate submission can return it
+    document['vector_id'] = vector_id
     # Save to Firestore and return the document ID
     db_id = db.create_document_db(document)
     current_app.logger.info(f'Database ID: {db_id}')
     return {
         "document": document, 
-        "db_id": db_id
+        "db_id": db_id,
+        "vector_id": vector_id,
+        "duplicate": False
     }
 
+@app.route('/documents/batch', methods=['POST'])
+def create_documents_batch_endpoint():
+    """Create many documents at once: concurrent Dify indexing, then batched Firestore writes."""
+    data = request.get_json(silent=True) or {}
+    items = data.get('documents')
+    if not isinstance(items, list) or not items:
+        return {'error': 'No documents provided'}, 400
+    if len(items) > BATCH_MAX_URLS:
+        return {'error': f'At most {BATCH_MAX_URLS} documents per batch'}, 400
+
+    results = [{"index": index} for index in range(len(items))]
+    valid = []
+    for index, item in enumerate(items):
+        document, error = db.build_document(item if isinstance(item, dict) else {})
+        if error:
+            results[index]["error"] = error
+        else:
+            valid.append((index, document))
+
+    with priority(PRIORITY_BATCH):
+        vectors = db.create_documents_vectors([(document['title'], document['content']) for _, document in valid])
+    indexed = []
+    for (index, document), document_vector in zip(valid, vectors):
+        if 'error' in document_vector:
+            results[index]["error"] = str(document_vector)
+        else:
+            results[index]["vector_id"] = document['vector_id'] = document_vector['document']['id']
+            indexed.append((index, document))
+
+    db_ids = db.create_documents_db([document for _, document in indexed])
+    for (index, _), db_id in zip(indexed, db_ids):
+        if isinstance(db_id, dict):
+            results[index]["error"] = db_id['error']
+        else:
+            results[index]["db_id"] = db_id
+
+    current_app.logger.info(f"Batch created {sum('db_id' in result for result in results)} of {len(items)} documents")
+    return {"results": results}
+
+startup_timing["import_seconds"] = round(time.perf_counter() - IMPORT_STARTED, 3)
+app.logger.info(f"Imported main.py in {startup_timing['import_seconds']} s")
+
 # Only with python app.py
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    if SERVING_MODE == 'async':
+        from async_app import serve
+        serve(app, host='0.0.0.0', port=5000)
+    else:
+        app.run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,170 @@
+# metrics.py
+
+import os
+import time
+import threading
+from contextlib import contextmanager
+from flask import g, has_app_context
+
+# Log one structured line per request with its stage timings
+REQUEST_TIMING_LOGS = os.environ.get('REQUEST_TIMING_LOGS', '0') == '1'
+
+DEFAULT_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+_registry = []
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def _labels(self, key, extra=()):
+        return tuple(zip(self.labelnames, key)) + tuple(extra)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        lines.extend(self._samples())
+        return lines
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [f'{self.name}{_format_labels(self._labels(key))} {value}' for key, value in items]
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        super().__init__(name, documentation, labelnames)
+        self._function = function
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def _samples(self):
+        if self._function is not None:
+            # Computed at scrape time
+            return [f'{self.name} {self._function()}']
+        with self._lock:
+            items = list(self._values.items())
+        return [f'{self.name}{_format_labels(self._labels(key))} {value}' for key, value in items]
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total, count = self._values.get(key, ([0] * len(self.buckets), 0.0, 0))
+            # Buckets are cumulative: a value counts towards every bound it fits under
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            self._values[key] = (counts, total + value, count + 1)
+
+    def _samples(self):
+        with self._lock:
+            items = [(key, (list(counts), total, count)) for key, (counts, total, count) in self._values.items()]
+        lines = []
+        for key, (counts, total, count) in items:
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append(f'{self.name}_bucket{_format_labels(self._labels(key, [("le", bound)]))} {bucket_count}')
+            lines.append(f'{self.name}_bucket{_format_labels(self._labels(key, [("le", "+Inf")]))} {count}')
+            lines.append(f'{self.name}_sum{_format_labels(self._labels(key))} {total}')
+            lines.append(f'{self.name}_count{_format_labels(self._labels(key))} {count}')
+        return lines
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+# Hot-path metrics shared by youtube_utils, db, pipeline and the endpoints
+stage_duration = Histogram('stage_duration_seconds', 'Time spent in each pipeline stage', ['stage'])
+stage_failures = Counter('stage_failures_total', 'Pipeline stage failures', ['stage'])
+request_duration = Histogram('http_request_duration_seconds', 'Request latency by endpoint', ['endpoint', 'status'])
+cache_requests = Counter('cache_requests_total', 'Result cache lookups', ['kind', 'result'])
+transcript_sources = Counter('transcript_source_total', 'Where transcripts came from', ['source'])
+downloads_in_flight = Gauge('downloads_in_flight', 'Audio downloads currently running')
+
+
+def directory_bytes(path):
+    """Total size of the files under path."""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass  # Removed while walking
+    return total
+
+
+def record_stage(stage, seconds):
+    stage_duration.observe(seconds, stage=stage)
+    # Also keep the timing for the per-request log when called while serving a request
+    if has_app_context():
+        timings = g.get('stage_timings')
+        if timings is not None:
+            timings.append((stage, round(seconds * 1000, 1)))
+
+
+@contextmanager
+def timed(stage):
+    """Time a block as a pipeline stage, counting it as a failure if it raises."""
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        stage_failures.inc(stage=stage)
+        raise
+    finally:
+        record_stage(stage, time.perf_counter() - started)
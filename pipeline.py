@@ -0,0 +1,285 @@
+# pipeline.py
+
+import os
+import time
+import threading
+from collections import OrderedDict
+from contextlib import nullcontext
+from flask import current_app
+from google.api_core.exceptions import GoogleAPICallError
+from yt_dlp.utils import DownloadCancelled
+from youtube_utils import BUCKET_NAME, download_audio, transcribe_audio_with_diarization, get_youtube_transcript, get_video_id, sign_gcs_uri, gcs_uri_exists
+from cache import get_cache, cache_key
+from transcript_store import TranscriptStore
+from singleflight import SingleFlight, process_lock
+from segmented_transcription import SEGMENTED_TRANSCRIPTION, transcribe_audio_segmented
+from metrics import transcript_sources
+from checkpoints import get_checkpoint_store
+
+# Also coalesce identical audio jobs across worker processes through lock files
+CROSS_PROCESS_COALESCING = os.environ.get('CROSS_PROCESS_COALESCING', '0') == '1'
+
+# Concurrent audio transcriptions of the same video and language share a single execution
+audio_flight = SingleFlight()
+
+# Decoded transcript stores kept for /transcript, so repeated clip lookups are binary searches
+# over an existing index instead of decoding the cached entry every time
+TRANSCRIPT_STORE_CACHE_SIZE = int(os.environ.get('TRANSCRIPT_STORE_CACHE_SIZE', 64))
+TRANSCRIPT_STORE_CACHE_TTL = int(os.environ.get('TRANSCRIPT_STORE_CACHE_TTL', 10 * 60))
+_stores = OrderedDict()  # (video_id, language_code, level) -> (expires_at, store)
+_stores_lock = threading.Lock()
+
+
+class _SharedDownload:
+    """One download of a video shared by every caller that needs it, speculative or not.
+
+    It is cancelled only once every caller has set its own cancel_event, and its progress
+    is reported to all of them.
+    """
+
+    def __init__(self):
+        self.cancel_events = []
+        self.listeners = []
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self._lock = threading.Lock()
+
+    def join(self, cancel_event, on_stage):
+        with self._lock:
+            self.cancel_events.append(cancel_event)
+            if on_stage is not None:
+                self.listeners.append(on_stage)
+
+    def is_set(self):
+        # Stands in for the cancel_event passed to download_audio
+        with self._lock:
+            return all(event is not None and event.is_set() for event in self.cancel_events)
+
+    def on_stage(self, stage, progress):
+        with self._lock:
+            listeners = list(self.listeners)
+        for listener in listeners:
+            listener(stage, progress)
+
+
+# Downloads in progress in this process, by video ID
+_downloads = {}
+_downloads_lock = threading.Lock()
+
+
+def _cached_transcript(key):
+    cached = get_cache().get('transcript', key)
+    if cached is None:
+        return None
+    # Signed URLs expire, so sign the stored blob again instead of caching the URL
+    return {
+        "download_url": sign_gcs_uri(cached['gcs_uri']),
+        "gcs_uri": cached['gcs_uri'],
+        "formatted_transcript": cached['formatted_transcript']
+    }
+
+
+def transcribe_from_audio(video_url, language_code, signed_url=None, on_stage=None):
+    """下载音频并生成带说话者区分的转录文本，按视频 ID 和语言缓存结果。
+
+    已经（推测性地）上传过音频时可以传入 signed_url 跳过下载。
+    """
+    video_id = get_video_id(video_url)
+    # youtu.be and shorts URLs have no ?v= to key on, so their transcripts are never cached
+    key = cache_key(video_id, language_code) if video_id else None
+    cached = _cached_transcript(key) if key else None
+    if cached is not None:
+        current_app.logger.info("Using cached audio transcript")
+        transcript_sources.inc(source='cache')
+        return cached
+
+    if key is None:
+        return _transcribe_from_audio_once(video_url, language_code, signed_url, on_stage)
+    return audio_flight.do(key, _transcribe_from_audio_once, video_url, language_code, signed_url, on_stage)
+
+
+def download_audio_shared(video_url, cancel_event=None, on_stage=None):
+    """下载音频；同一视频的并发下载（包括推测性下载）只执行一次。"""
+    video_id = get_video_id(video_url)
+    if not video_id:
+        return download_audio(video_url, cancel_event=cancel_event, on_stage=on_stage)
+
+    with _downloads_lock:
+        download = _downloads.get(video_id)
+        leader = download is None
+        if leader:
+            download = _downloads[video_id] = _SharedDownload()
+        download.join(cancel_event, on_stage)
+
+    if not leader:
+        download.done.wait()
+        if download.error is None:
+            return download.result
+        if isinstance(download.error, DownloadCancelled) and not (cancel_event is not None and cancel_event.is_set()):
+            # Every earlier caller gave up before this one joined, but this one still needs the audio
+            return download_audio_shared(video_url, cancel_event, on_stage)
+        raise download.error
+
+    try:
+        download.result = download_audio(video_url, cancel_event=download, on_stage=download.on_stage)
+        return download.result
+    except BaseException as e:
+        download.error = e
+        raise
+    finally:
+        with _downloads_lock:
+            del _downloads[video_id]
+        download.done.set()
+
+
+def _transcribe_from_audio_once(video_url, language_code, signed_url, on_stage):
+    video_id = get_video_id(video_url)
+    key = cache_key(video_id, language_code) if video_id else None
+    lock = process_lock(f'audio-{video_id}') if CROSS_PROCESS_COALESCING and video_id else nullcontext(True)
+    with lock:
+        # Another process may have finished the same video while we waited for the lock
+        cached = _cached_transcript(key) if key else None
+        if cached is not None:
+            current_app.logger.info("Using audio transcript produced by another worker")
+            transcript_sources.inc(source='cache')
+            return cached
+        return _run_audio_pipeline(video_url, key, signed_url, on_stage)
+
+
+def _run_audio_pipeline(video_url, key, signed_url, on_stage):
+    cache = get_cache()
+    # Progress is checkpointed so a retry after the worker died picks up where it stopped
+    checkpoints = get_checkpoint_store()
+    checkpoint = (checkpoints.get(key) if key else None) or {}
+
+    def update_checkpoint(**fields):
+        if key:
+            checkpoints.update(key, **fields)
+
+    current_app.logger.info("Transcribing from audio")
+    if signed_url is None and checkpoint.get('gcs_uri') and not gcs_uri_exists(checkpoint['gcs_uri']):
+        # Evicted, expired by the lifecycle rule or a deleted partial upload
+        current_app.logger.info("Checkpointed audio no longer exists, downloading again")
+        checkpoint = {}
+    if signed_url is None and checkpoint.get('gcs_uri'):
+        current_app.logger.info(f"Resuming from checkpoint at stage {checkpoint.get('stage')}")
+        gcs_uri = checkpoint['gcs_uri']
+        signed_url = sign_gcs_uri(gcs_uri)
+    else:
+        if signed_url is None:
+            signed_url = download_audio_shared(video_url, on_stage=on_stage)
+        # Extract the blob name from the signed URL
+        blob_name = signed_url.split('/')[-1].split('?')[0]
+        gcs_uri = f'gs://{BUCKET_NAME}/audio/{blob_name}'
+        if checkpoint.get('gcs_uri') != gcs_uri:
+            checkpoint = {}  # An operation for other audio cannot be reused
+        update_checkpoint(stage='uploaded', gcs_uri=gcs_uri, operation_name=checkpoint.get('operation_name'))
+
+    def save_operation(operation_name):
+        update_checkpoint(stage='recognizing', operation_name=operation_name)
+
+    # Generate transcription
+    try:
+        if SEGMENTED_TRANSCRIPTION:
+            transcription_result = transcribe_audio_segmented(gcs_uri, on_stage=on_stage)
+        else:
+            transcription_result = transcribe_audio_with_diarization(
+                gcs_uri, on_stage=on_stage, operation_name=checkpoint.get('operation_name'), on_operation=save_operation
+            )
+    except GoogleAPICallError:
+        # The operation itself failed, possibly because the audio is gone, so a retry starts
+        # over (download_audio still reuses stored audio); timeouts and overload keep the
+        # checkpoint so the retry can reattach
+        if key:
+            checkpoints.delete(key)
+        raise
+    transcript_sources.inc(source='audio')
+    if key:
+        cache.set('transcript', key, {
+            "gcs_uri": gcs_uri,
+            "formatted_transcript": transcription_result['formatted_transcript'],
+            "segments": transcription_result['segments'].to_dict(),
+            "words": transcription_result['words'].to_dict()
+        })
+        # The cached transcript supersedes the checkpoint
+        checkpoints.delete(key)
+    return {
+        "download_url": signed_url,
+        "gcs_uri": gcs_uri,
+        "formatted_transcript": transcription_result['formatted_transcript']
+    }
+
+
+def transcribe_video(video_url, language_code, on_stage=None):
+    """优先使用官方字幕，没有字幕时回退到音频转录。"""
+    if on_stage is not None:
+        on_stage('captions', None)
+    transcription_result = get_youtube_transcript(video_url)
+
+    if 'error' not in transcription_result:
+        current_app.logger.info("Found native transcripts")
+        transcript_sources.inc(source='captions')
+        return {
+            "download_url": "",
+            "gcs_uri": "",
+            "formatted_transcript": transcription_result['formatted_transcript']
+        }
+
+    return transcribe_from_audio(video_url, language_code, on_stage=on_stage)
+
+
+def should_speculate(video_url, language_code):
+    """仅当缓存中既没有官方字幕也没有音频转录时才值得推测性下载音频。"""
+    cache = get_cache()
+    video_id = get_video_id(video_url)
+    if not video_id:
+        return False
+    if audio_flight.in_flight(cache_key(video_id, language_code)) or video_id in _downloads:
+        # Another request is already fetching this audio, so wait for it instead of downloading again
+        return False
+    captions = cache.get('captions', video_id)
+    if captions is not None and 'error' not in captions:
+        return False
+    return cache.get('transcript', cache_key(video_id, language_code)) is None
+
+
+def load_transcript_store(video_url, language_code, level='segments'):
+    """返回视频转录的 TranscriptStore（level 为 segments 或 words），缓存中没有时先转录。
+
+    官方字幕只有句级时间，因此有字幕时总是返回字幕片段。
+    """
+    video_id = get_video_id(video_url)
+    if not video_id:
+        # Nothing is cached for URLs without a video ID, so there is no store to load
+        return None
+
+    store_key = (video_id, language_code, level)
+    with _stores_lock:
+        entry = _stores.get(store_key)
+        if entry is not None and entry[0] > time.time():
+            _stores.move_to_end(store_key)
+            return entry[1]
+
+    store = _load_transcript_store(video_url, video_id, language_code, level)
+    if store is not None:
+        with _stores_lock:
+            _stores[store_key] = (time.time() + TRANSCRIPT_STORE_CACHE_TTL, store)
+            _stores.move_to_end(store_key)
+            while len(_stores) > TRANSCRIPT_STORE_CACHE_SIZE:
+                _stores.popitem(last=False)
+    return store
+
+
+def _load_transcript_store(video_url, video_id, language_code, level):
+    cache = get_cache()
+    for attempt in range(2):
+        captions = cache.get('captions', video_id)
+        if captions is not None and 'segments' in captions:
+            return TranscriptStore.from_dict(captions['segments'])
+        transcript = cache.get('transcript', cache_key(video_id, language_code))
+        if transcript is not None and level in transcript:
+            return TranscriptStore.from_dict(transcript[level])
+        if attempt == 0:
+            transcribe_video(video_url, language_code)
+    return None
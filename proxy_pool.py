@@ -0,0 +1,183 @@
+# proxy_pool.py
+
+import os
+import time
+import random
+import threading
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor, TimeoutError, wait, FIRST_COMPLETED
+from utils import load_api_key
+from metrics import Counter
+
+# Used when neither the credentials file ("proxies") nor TRANSCRIPT_PROXIES lists any
+DEFAULT_PROXY = "http://GS8dcJybiiSaxSg5XyhF3w:@smartproxy.crawlbase.com:8012"
+# Comma-separated proxy URLs; overrides the credentials file
+TRANSCRIPT_PROXIES = os.environ.get('TRANSCRIPT_PROXIES', '')
+# Start the same fetch on a second proxy when the first has not answered after this many seconds
+PROXY_HEDGE_AFTER = float(os.environ.get('PROXY_HEDGE_AFTER', 2.0))
+# Proxy attempts stop being waited for after this many seconds; the call then goes direct or fails
+PROXY_TIMEOUT = float(os.environ.get('PROXY_TIMEOUT', 20.0))
+# Consecutive failures that open a proxy's circuit, and how long it stays open
+PROXY_FAILURE_THRESHOLD = int(os.environ.get('PROXY_FAILURE_THRESHOLD', 3))
+PROXY_COOLDOWN = float(os.environ.get('PROXY_COOLDOWN', 60))
+# Try without a proxy once every proxy attempt has failed
+PROXY_DIRECT_FALLBACK = os.environ.get('PROXY_DIRECT_FALLBACK', '1') == '1'
+# Weight of the newest sample in the latency and error-rate moving averages
+PROXY_EWMA_WEIGHT = 0.2
+
+proxy_executor = ThreadPoolExecutor(max_workers=int(os.environ.get('PROXY_WORKERS', 32)), thread_name_prefix='proxy')
+
+proxy_requests = Counter('proxy_requests_total', 'Caption fetches per proxy', ['proxy', 'result'])
+proxy_hedges = Counter('proxy_hedges_total', 'Caption fetches hedged on a second proxy')
+
+
+class Proxy:
+    def __init__(self, url):
+        self.url = url
+        # Label for logs and metrics without the credentials in the URL
+        parsed = urlparse(url)
+        self.label = f"{parsed.hostname}:{parsed.port}" if parsed.port else parsed.hostname or url
+        self.latency = None
+        self.error_rate = 0.0
+        self.failures = 0
+        self.open_until = 0.0
+
+    @property
+    def proxies(self):
+        return {"http": self.url, "https": self.url}
+
+    def score(self):
+        """Lower is healthier. Untried proxies score 0 so each gets tried."""
+        if self.latency is None:
+            return 0.0
+        return self.latency * (1 + 4 * self.error_rate)
+
+
+class ProxyPool:
+    """Proxies chosen by health score, with per-proxy circuit breakers and hedged requests."""
+
+    def __init__(self, urls, direct_fallback=PROXY_DIRECT_FALLBACK):
+        self.proxies = [Proxy(url) for url in urls]
+        self.direct_fallback = direct_fallback
+        self._lock = threading.Lock()
+
+    def choose(self, exclude=()):
+        """Pick the healthier of two random available proxies; None when none is available."""
+        now = time.monotonic()
+        with self._lock:
+            candidates = [proxy for proxy in self.proxies if proxy not in exclude and proxy.open_until <= now]
+            if not candidates:
+                return None
+            proxy = min(random.sample(candidates, min(2, len(candidates))), key=Proxy.score)
+            if proxy.failures >= PROXY_FAILURE_THRESHOLD:
+                # Half-open: this call is the trial, everyone else keeps skipping the proxy until it reports back
+                proxy.open_until = now + PROXY_COOLDOWN
+            return proxy
+
+    def _record(self, proxy, seconds, ok):
+        with self._lock:
+            proxy.latency = seconds if proxy.latency is None else (
+                (1 - PROXY_EWMA_WEIGHT) * proxy.latency + PROXY_EWMA_WEIGHT * seconds
+            )
+            proxy.error_rate = (1 - PROXY_EWMA_WEIGHT) * proxy.error_rate + PROXY_EWMA_WEIGHT * (0.0 if ok else 1.0)
+            if ok:
+                proxy.failures = 0
+                proxy.open_until = 0.0
+            else:
+                proxy.failures += 1
+                if proxy.failures >= PROXY_FAILURE_THRESHOLD:
+                    proxy.open_until = time.monotonic() + PROXY_COOLDOWN
+        proxy_requests.inc(proxy=proxy.label, result='ok' if ok else 'error')
+
+    def _attempt(self, proxy, fn, definitive):
+        started = time.perf_counter()
+        try:
+            result = fn(proxy.proxies)
+        except definitive:
+            # An answer such as "captions disabled" means the proxy itself worked
+            self._record(proxy, time.perf_counter() - started, True)
+            raise
+        except Exception:
+            self._record(proxy, time.perf_counter() - started, False)
+            raise
+        self._record(proxy, time.perf_counter() - started, True)
+        return result
+
+    def call(self, fn, definitive=(), timeout=PROXY_TIMEOUT):
+        """Run fn(proxies) through the pool and return the first successful result.
+
+        If the first proxy has not answered after PROXY_HEDGE_AFTER seconds (or has failed),
+        the call is repeated on a second proxy. Exceptions in definitive are real answers and
+        are raised straight away. When every proxy attempt fails, or none has answered within
+        timeout seconds, fn(None) goes direct.
+        """
+        deadline = time.monotonic() + timeout
+        attempted = []
+        pending = set()
+        last_error = None
+        for _ in range(2):
+            proxy = self.choose(exclude=attempted)
+            if proxy is None:
+                break
+            if attempted:
+                proxy_hedges.inc()
+            attempted.append(proxy)
+            pending.add(proxy_executor.submit(self._attempt, proxy, fn, definitive))
+
+            # After the hedge has been sent, wait for whichever attempt finishes
+            while pending:
+                remaining = max(0.0, deadline - time.monotonic())
+                wait_for = min(PROXY_HEDGE_AFTER, remaining) if len(attempted) == 1 else remaining
+                done, pending = wait(pending, timeout=wait_for, return_when=FIRST_COMPLETED)
+                if not done:
+                    break  # First proxy is slow: hedge, or the deadline has passed
+                for future in done:
+                    try:
+                        return future.result()
+                    except definitive:
+                        raise
+                    except Exception as e:
+                        last_error = e
+                if len(attempted) == 1:
+                    break  # First proxy failed: try a second one now
+            if time.monotonic() >= deadline:
+                break
+
+        # Attempts still running (e.g. no second proxy was available) get what is left of the deadline
+        for future in pending:
+            try:
+                return future.result(timeout=max(0.0, deadline - time.monotonic()))
+            except definitive:
+                raise
+            except TimeoutError:
+                # Left running in the background; it still reports to the proxy's health when done
+                last_error = TimeoutError(f"No caption proxy answered within {timeout} s")
+            except Exception as e:
+                last_error = e
+
+        if self.direct_fallback:
+            return fn(None)
+        raise last_error or RuntimeError("No caption proxy available")
+
+
+def load_proxy_urls():
+    if TRANSCRIPT_PROXIES:
+        return [url.strip() for url in TRANSCRIPT_PROXIES.split(',') if url.strip()]
+    configured = load_api_key('proxies')
+    if isinstance(configured, str):
+        configured = [configured]
+    return configured or [DEFAULT_PROXY]
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_proxy_pool():
+    """Return the process-wide caption proxy pool, loading its configuration on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ProxyPool(load_proxy_urls())
+    return _pool
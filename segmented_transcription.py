@@ -0,0 +1,232 @@
+# segmented_transcription.py
+
+import os
+import re
+import uuid
+import subprocess
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from google.cloud import speech
+from youtube_utils import BUCKET_NAME, recognition_config, wait_for_recognition, transcribe_audio_with_diarization, sign_gcs_uri, format_timestamp, load_time_map
+from utils import with_app_context
+from clients import get_bucket, get_speech_client
+from transcript_store import TranscriptStore
+from admission import admit
+
+# Split long audio into overlapping segments that are recognized concurrently
+SEGMENTED_TRANSCRIPTION = os.environ.get('SEGMENTED_TRANSCRIPTION', '0') == '1'
+SEGMENT_SECONDS = int(os.environ.get('SEGMENT_SECONDS', 300))
+SEGMENT_OVERLAP_SECONDS = int(os.environ.get('SEGMENT_OVERLAP_SECONDS', 10))
+# Concurrent long_running_recognize operations across all videos; keep below the project's Speech quota
+SEGMENT_CONCURRENCY = int(os.environ.get('SEGMENT_CONCURRENCY', 4))
+# Words from neighbouring segments this close in time are treated as the same word
+WORD_MATCH_TOLERANCE = 0.5
+
+segment_executor = ThreadPoolExecutor(max_workers=SEGMENT_CONCURRENCY, thread_name_prefix='segment')
+
+CJK_CHARACTER = re.compile(r'[\u3000-\u9fff\uac00-\ud7af\uff00-\uffef]')
+
+
+def probe_duration(url):
+    """用 ffprobe 读取音频时长（秒）。"""
+    output = subprocess.run(
+        ['ffprobe', '-v', 'error', '-show_entries', 'format=duration', '-of', 'default=noprint_wrappers=1:nokey=1', url],
+        capture_output=True, text=True, check=True
+    ).stdout.strip()
+    return float(output)
+
+
+def plan_segments(duration):
+    """返回 [(start, length)]，相邻片段重叠 SEGMENT_OVERLAP_SECONDS 秒。"""
+    segments = []
+    start = 0.0
+    while True:
+        length = min(SEGMENT_SECONDS + SEGMENT_OVERLAP_SECONDS, duration - start)
+        segments.append((start, length))
+        if start + length >= duration:
+            return segments
+        start += SEGMENT_SECONDS
+
+
+def _transcribe_segment(signed_url, base, index, start, length):
+    # ffmpeg seeks with range requests, so only this segment's bytes are fetched
+    with admit('ffmpeg'):
+        audio = subprocess.run(
+            ['ffmpeg', '-loglevel', 'error', '-ss', str(start), '-t', str(length), '-i', signed_url,
+             '-vn', '-ar', '16000', '-ac', '1', '-f', 'flac', 'pipe:1'],
+            capture_output=True, check=True
+        ).stdout
+
+    blob = get_bucket(BUCKET_NAME).blob(f'audio/segments/{base}/{index:04}.flac')
+    with admit('gcs'):
+        blob.upload_from_string(audio, content_type='audio/flac')
+    gcs_uri = f'gs://{BUCKET_NAME}/{blob.name}'
+    current_app.logger.info(f"Recognizing segment {index} ({start:.0f}s +{length:.0f}s): {gcs_uri}")
+
+    try:
+        client = get_speech_client()
+        with admit('speech'):
+            operation = client.long_running_recognize(
+                config=recognition_config(gcs_uri),
+                audio=speech.RecognitionAudio(uri=gcs_uri)
+            )
+            response = wait_for_recognition(operation)
+    finally:
+        blob.delete()
+
+    # Shift word offsets from segment time to video time
+    utterances = []
+    for result in response.results:
+        alternative = result.alternatives[0]
+        if not alternative.transcript.strip() or not alternative.words:
+            continue
+        utterances.append({
+            'transcript': alternative.transcript,
+            'words': [
+                (start + word.start_time.total_seconds(), start + word.end_time.total_seconds(), word.speaker_tag, word.word)
+                for word in alternative.words
+            ]
+        })
+    return utterances
+
+
+def _normalize_word(word):
+    return re.sub(r'[^\w]', '', word.lower())
+
+
+def _join_words(words):
+    text = ''
+    for word in words:
+        if not word:
+            continue
+        # CJK text is not space separated
+        if text and not (CJK_CHARACTER.match(text[-1]) and CJK_CHARACTER.match(word[0])):
+            text += ' '
+        text += word
+    return text
+
+
+def _speaker_mapping(previous, current, overlap_start, overlap_end):
+    """根据重叠区间内相同的词，把 current 片段的说话者编号映射到 previous 片段的编号。"""
+    previous_words = [
+        word for utterance in previous for word in utterance['words']
+        if overlap_start <= word[0] < overlap_end and word[2]
+    ]
+    pairs = Counter()
+    for utterance in current:
+        for start, _, tag, text in utterance['words']:
+            if not tag or not overlap_start <= start < overlap_end:
+                continue
+            for previous_start, _, previous_tag, previous_text in previous_words:
+                if abs(previous_start - start) <= WORD_MATCH_TOLERANCE and _normalize_word(previous_text) == _normalize_word(text):
+                    pairs[(tag, previous_tag)] += 1
+                    break
+
+    mapping = {}
+    for (tag, previous_tag), _ in pairs.most_common():
+        if tag not in mapping and previous_tag not in mapping.values():
+            mapping[tag] = previous_tag
+
+    # Speakers that never talk during the overlap get a number nobody else uses
+    used = set(mapping.values())
+    for utterance in current:
+        for _, _, tag, _ in utterance['words']:
+            if tag not in mapping:
+                candidate = tag
+                while candidate in used:
+                    candidate += 1
+                mapping[tag] = candidate
+                used.add(candidate)
+    return mapping
+
+
+def merge_segments(segments, segment_utterances):
+    """合并各片段的识别结果：修正时间偏移、去掉重叠部分的重复词并统一说话者编号。"""
+    # Each overlap is split at its midpoint; words before the cut come from the earlier segment
+    cuts = [0.0] + [start + SEGMENT_OVERLAP_SECONDS / 2 for start, _ in segments[1:]] + [float('inf')]
+
+    lines = []
+    previous = None
+    for i, utterances in enumerate(segment_utterances):
+        if previous is not None:
+            previous_start, previous_length = segments[i - 1]
+            mapping = _speaker_mapping(previous, utterances, segments[i][0], previous_start + previous_length)
+            utterances = [
+                {
+                    'transcript': utterance['transcript'],
+                    'words': [(start, end, mapping.get(tag, tag), text) for start, end, tag, text in utterance['words']]
+                }
+                for utterance in utterances
+            ]
+        previous = utterances
+
+        for utterance in utterances:
+            kept = [word for word in utterance['words'] if cuts[i] <= word[0] < cuts[i + 1]]
+            if not kept:
+                continue
+            if len(kept) == len(utterance['words']):
+                transcript = utterance['transcript']
+            else:
+                transcript = _join_words([word[3] for word in kept])
+            lines.append({
+                'start_time': kept[0][0],
+                'speaker_tag': kept[0][2],
+                'transcript': transcript,
+                'words': [
+                    {'word': text, 'start_time': start, 'end_time': end, 'speaker_tag': tag}
+                    for start, end, tag, text in kept
+                ]
+            })
+    return lines
+
+
+def transcribe_audio_segmented(gcs_uri, on_stage=None):
+    """把长音频切成重叠片段并发识别，再拼接成与 transcribe_audio_with_diarization 相同格式的转录文本。"""
+    # Segments may wait in the queue for a while, so sign for longer than usual
+    signed_url = sign_gcs_uri(gcs_uri, expiration=6 * 60 * 60)
+    segments = plan_segments(probe_duration(signed_url))
+    if len(segments) == 1:
+        return transcribe_audio_with_diarization(gcs_uri, on_stage=on_stage)
+
+    current_app.logger.info(f"Transcribing {gcs_uri} as {len(segments)} segments")
+    if on_stage is not None:
+        on_stage('recognizing', 0)
+
+    base = uuid.uuid4().hex
+    transcribe_segment = with_app_context(_transcribe_segment)
+    futures = [
+        segment_executor.submit(transcribe_segment, signed_url, base, index, start, length)
+        for index, (start, length) in enumerate(segments)
+    ]
+    segment_utterances = []
+    for future in futures:
+        segment_utterances.append(future.result())
+        if on_stage is not None:
+            on_stage('recognizing', round(100 * len(segment_utterances) / len(segments), 1))
+
+    if on_stage is not None:
+        on_stage('formatting', None)
+    lines = merge_segments(segments, segment_utterances)
+    time_map = load_time_map(gcs_uri)
+    if time_map is not None:
+        # Segments were cut from silence-trimmed audio; report times on the video's timeline
+        for line in lines:
+            line['start_time'] = time_map.to_original(line['start_time'])
+            for word in line['words']:
+                word['start_time'] = time_map.to_original(word['start_time'])
+                word['end_time'] = time_map.to_original(word['end_time'])
+    return {
+        'formatted_transcript': "\n".join(
+            f"[{format_timestamp(line['start_time'])}] Speaker {line['speaker_tag']}: {line['transcript']}"
+            for line in lines
+        ),
+        'segments': TranscriptStore.from_segments(
+            (line['start_time'], line['words'][-1]['end_time'], line['speaker_tag'], line['transcript'])
+            for line in lines
+        ),
+        'words': TranscriptStore.from_segments(
+            (word['start_time'], word['end_time'], word['speaker_tag'], word['word'])
+            for line in lines for word in line['words']
+        )
+    }
@@ -0,0 +1,108 @@
+# singleflight.py
+
+import os
+import re
+import time
+import fcntl
+import asyncio
+import threading
+from contextlib import contextmanager
+
+# Directory holding the per-key lock files used to coalesce work across processes
+LOCK_DIR = os.environ.get('LOCK_DIR', '/app/tmp/locks')
+# Give up waiting for another process after this many seconds and do the work anyway
+LOCK_TIMEOUT = int(os.environ.get('LOCK_TIMEOUT', 15 * 60))
+
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key into one execution whose result all callers share."""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def in_flight(self, key):
+        with self._lock:
+            return key in self._calls
+
+    def do(self, key, fn, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+
+class AsyncSingleFlight:
+    """SingleFlight for coroutines on one event loop.
+
+    The shared call runs as its own task, so a caller that is cancelled (e.g. its client
+    disconnected) does not cancel the work the other callers are waiting for.
+    """
+
+    def __init__(self):
+        self._tasks = {}
+
+    def in_flight(self, key):
+        return key in self._tasks
+
+    async def do(self, key, fn, *args, **kwargs):
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn(*args, **kwargs))
+            self._tasks[key] = task
+            task.add_done_callback(lambda _: self._tasks.pop(key, None))
+        return await asyncio.shield(task)
+
+
+@contextmanager
+def process_lock(key, timeout=LOCK_TIMEOUT):
+    """Hold an exclusive lock file for key so only one process works on it at a time.
+
+    The lock is released automatically if the holding process dies. Yields True when
+    the lock was acquired and False when waiting timed out.
+    """
+    os.makedirs(LOCK_DIR, exist_ok=True)
+    path = os.path.join(LOCK_DIR, re.sub(r'[^A-Za-z0-9_.-]', '_', key) + '.lock')
+    with open(path, 'w') as lock_file:
+        deadline = time.monotonic() + timeout
+        acquired = False
+        while True:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                acquired = True
+                break
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    break
+                time.sleep(1)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
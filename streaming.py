@@ -0,0 +1,106 @@
+# streaming.py
+
+import json
+import queue
+import threading
+import traceback
+from flask import Response, request, stream_with_context, current_app
+from youtube_utils import get_youtube_video_metadata
+from pipeline import transcribe_video
+from utils import with_app_context
+from admission import Overloaded
+
+STREAM_MIMETYPES = {
+    'ndjson': 'application/x-ndjson',
+    'sse': 'text/event-stream',
+}
+# Seconds without events before an SSE comment is sent to keep proxies from closing the connection
+SSE_HEARTBEAT_SECONDS = 15
+
+
+def stream_mode():
+    """根据 Accept 头判断客户端是否请求流式响应，返回 'ndjson'、'sse' 或 None。"""
+    accept = request.headers.get('Accept', '')
+    if STREAM_MIMETYPES['ndjson'] in accept:
+        return 'ndjson'
+    if STREAM_MIMETYPES['sse'] in accept:
+        return 'sse'
+    return None
+
+
+def _encode(mode, event, data):
+    if mode == 'sse':
+        return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+    return json.dumps({"event": event, "data": data}, ensure_ascii=False) + "\n"
+
+
+def stream_transcription(video_url, language_code, mode, include_metadata=True):
+    """以流式事件返回转录过程：metadata、stage、line，最后是 done 或 error。"""
+    events = queue.Queue()
+    last_stage = {}
+
+    def emit(event, data):
+        events.put((event, data))
+
+    def on_stage(stage, progress):
+        # Streaming uploads and recognition polls repeat the same stage; only send changes
+        if last_stage.get('value') == (stage, progress):
+            return
+        last_stage['value'] = (stage, progress)
+        emit('stage', {"stage": stage, "progress": progress})
+
+    def run_metadata():
+        emit('metadata', get_youtube_video_metadata(video_url))
+
+    def run():
+        metadata_thread = None
+        try:
+            if include_metadata:
+                metadata_thread = threading.Thread(target=with_app_context(run_metadata), daemon=True)
+                metadata_thread.start()
+
+            result = transcribe_video(video_url, language_code, on_stage=on_stage)
+            for line in result['formatted_transcript'].splitlines():
+                emit('line', {"text": line})
+
+            if metadata_thread is not None:
+                metadata_thread.join()
+            emit('done', {
+                "download_url": result['download_url'],
+                "gcs_uri": result['gcs_uri']
+            })
+        except Overloaded as e:
+            # Headers are already sent, so report the overload as the final event
+            current_app.logger.warning(f"Streaming rejected: {str(e)}")
+            emit('error', {
+                "error": str(e),
+                "retry_after": e.retry_after
+            })
+        except Exception as e:
+            current_app.logger.error(f"Streaming error: {str(e)}")
+            emit('error', {
+                "error": str(e),
+                "traceback": traceback.format_exc()
+            })
+        finally:
+            events.put(None)
+
+    threading.Thread(target=with_app_context(run), daemon=True).start()
+
+    def generate():
+        while True:
+            try:
+                item = events.get(timeout=SSE_HEARTBEAT_SECONDS)
+            except queue.Empty:
+                if mode == 'sse':
+                    yield ": keep-alive\n\n"
+                continue
+            if item is None:
+                return
+            yield _encode(mode, *item)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype=STREAM_MIMETYPES[mode],
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
@@ -0,0 +1,137 @@
+# transcript_store.py
+
+import base64
+from array import array
+from bisect import bisect_left, bisect_right
+
+
+class TranscriptStore:
+    """Columnar transcript: parallel arrays of start, end and speaker plus one text buffer with offsets.
+
+    Segments are kept sorted by start time, so time-range lookups are binary searches and
+    per-segment dicts are only built for the rows a caller asks for.
+    """
+
+    def __init__(self, starts=None, ends=None, speakers=None, offsets=None, text=''):
+        self.starts = starts if starts is not None else array('d')
+        self.ends = ends if ends is not None else array('d')
+        self.speakers = speakers if speakers is not None else array('i')
+        self.offsets = offsets if offsets is not None else array('I', [0])
+        self.text = text
+        self._max_ends = None
+
+    @classmethod
+    def from_segments(cls, segments):
+        """Build a store from (start, end, speaker, text) tuples."""
+        store = cls()
+        parts = []
+        position = 0
+        for start, end, speaker, text in sorted(segments, key=lambda segment: segment[0]):
+            store.starts.append(start)
+            store.ends.append(end)
+            store.speakers.append(speaker)
+            parts.append(text)
+            position += len(text)
+            store.offsets.append(position)
+        store.text = ''.join(parts)
+        return store
+
+    @classmethod
+    def from_captions(cls, transcript):
+        """Build a store from youtube-transcript-api entries ({'start', 'duration', 'text'})."""
+        return cls.from_segments(
+            (entry['start'], entry['start'] + entry.get('duration', 0), 0, entry['text'].replace('\n', ' ').strip())
+            for entry in transcript
+        )
+
+    def __len__(self):
+        return len(self.starts)
+
+    def text_at(self, index):
+        return self.text[self.offsets[index]:self.offsets[index + 1]]
+
+    def segment(self, index):
+        return {
+            'start': self.starts[index],
+            'end': self.ends[index],
+            'speaker': self.speakers[index],
+            'text': self.text_at(index)
+        }
+
+    def find_range(self, start=None, end=None):
+        """Return (lo, hi) so every segment overlapping [start, end) is in rows lo..hi-1."""
+        if self._max_ends is None:
+            # Running maximum of end times is monotonic, so it can be binary searched too.
+            # Built aside and then published, since stores are shared between request threads.
+            max_ends = array('d')
+            running = float('-inf')
+            for value in self.ends:
+                running = max(running, value)
+                max_ends.append(running)
+            self._max_ends = max_ends
+        lo = 0 if start is None else bisect_right(self._max_ends, start)
+        hi = len(self) if end is None else bisect_left(self.starts, end)
+        return lo, max(lo, hi)
+
+    def indices(self, start=None, end=None):
+        """Row indices of the segments overlapping [start, end)."""
+        lo, hi = self.find_range(start, end)
+        if start is None:
+            return range(lo, hi)
+        # A long earlier segment can pull lo back past shorter ones that ended before start
+        return [index for index in range(lo, hi) if self.ends[index] > start]
+
+    def segments(self, start=None, end=None):
+        return [self.segment(index) for index in self.indices(start, end)]
+
+    def to_srt(self, start=None, end=None):
+        cues = []
+        for number, index in enumerate(self.indices(start, end), 1):
+            cues.append(
+                f"{number}\n{_cue_time(self.starts[index], ',')} --> {_cue_time(self.ends[index], ',')}\n{self.text_at(index)}\n"
+            )
+        return "\n".join(cues)
+
+    def to_vtt(self, start=None, end=None):
+        cues = ["WEBVTT\n"]
+        for index in self.indices(start, end):
+            speaker = self.speakers[index]
+            text = f"<v Speaker {speaker}>{self.text_at(index)}" if speaker else self.text_at(index)
+            cues.append(f"{_cue_time(self.starts[index], '.')} --> {_cue_time(self.ends[index], '.')}\n{text}\n")
+        return "\n".join(cues)
+
+    def to_text(self, start=None, end=None, separator='\n'):
+        return separator.join(self.text_at(index) for index in self.indices(start, end))
+
+    def to_dict(self):
+        """Compact JSON-serializable form (base64 array buffers) for the result cache."""
+        return {
+            'starts': base64.b64encode(self.starts.tobytes()).decode('ascii'),
+            'ends': base64.b64encode(self.ends.tobytes()).decode('ascii'),
+            'speakers': base64.b64encode(self.speakers.tobytes()).decode('ascii'),
+            'offsets': base64.b64encode(self.offsets.tobytes()).decode('ascii'),
+            'text': self.text
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        def decode(typecode, value):
+            values = array(typecode)
+            values.frombytes(base64.b64decode(value))
+            return values
+
+        return cls(
+            starts=decode('d', data['starts']),
+            ends=decode('d', data['ends']),
+            speakers=decode('i', data['speakers']),
+            offsets=decode('I', data['offsets']),
+            text=data['text']
+        )
+
+
+def _cue_time(seconds, decimal_separator):
+    milliseconds = int(round(seconds * 1000))
+    hours, milliseconds = divmod(milliseconds, 3600 * 1000)
+    minutes, milliseconds = divmod(milliseconds, 60 * 1000)
+    seconds, milliseconds = divmod(milliseconds, 1000)
+    return f"{hours:02}:{minutes:02}:{seconds:02}{decimal_separator}{milliseconds:03}"
@@ -1,5 +1,15 @@
 import os
 import json
+import functools
+from flask import current_app, g, has_app_context
+from admission import current_priority, priority
+
+
+@functools.lru_cache(maxsize=4)
+def load_credentials(credentials_path):
+    # Load the JSON credentials file once per path
+    with open(credentials_path, 'r') as file:
+        return json.load(file)
 
 
 def load_api_key(api_key_name):
@@ -7,8 +17,24 @@ def load_api_key(api_key_name):
     if not credentials_path:
         raise ValueError("GOOGLE_APPLICATION_CREDENTIALS environment variable is not set.")
     
-    # Load the JSON credentials file
-    with open(credentials_path, 'r') as file:
-        credentials = json.load(file)
+    credentials = load_credentials(credentials_path)
     
     return credentials.get(api_key_name)
+
+
+def with_app_context(func):
+    """Wrap func so it runs inside the current Flask app context when called from another thread."""
+    app = current_app._get_current_object()
+    # Share the caller's stage timings so work done in the thread shows up in the request log
+    stage_timings = g.get('stage_timings') if has_app_context() else None
+    # Work handed to another thread keeps the caller's admission priority
+    level = current_priority()
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with app.app_context(), priority(level):
+            if stage_timings is not None:
+                g.stage_timings = stage_timings
+            return func(*args, **kwargs)
+
+    return wrapper
@@ -0,0 +1,129 @@
+# vad.py
+
+import os
+import wave
+from bisect import bisect_right
+import numpy as np
+
+# Cut long non-speech spans out of downloaded WAV audio before it is uploaded and recognized
+VAD_ENABLED = os.environ.get('VAD_ENABLED', '0') == '1'
+VAD_FRAME_MS = 30
+# A frame is speech when its energy is this many dB above the quietest 10% of frames
+VAD_THRESHOLD_DB = float(os.environ.get('VAD_THRESHOLD_DB', 12))
+# Only silences longer than this are cut; speech keeps this much padding on each side
+VAD_MIN_SILENCE = float(os.environ.get('VAD_MIN_SILENCE', 1.0))
+VAD_PADDING = float(os.environ.get('VAD_PADDING', 0.25))
+# Leave the file alone unless trimming removes at least this share of it
+VAD_MIN_SAVING = float(os.environ.get('VAD_MIN_SAVING', 0.05))
+# Audio is analysed and copied this many seconds at a time
+VAD_CHUNK_SECONDS = 60
+
+
+class TimeMap:
+    """Maps times in trimmed audio back to times in the original audio.
+
+    Each kept span is stored as (trimmed_start, original_start); inside a span the
+    two timelines advance together.
+    """
+
+    def __init__(self, trimmed_starts, original_starts):
+        self.trimmed_starts = list(trimmed_starts)
+        self.original_starts = list(original_starts)
+
+    def to_original(self, seconds):
+        index = max(0, bisect_right(self.trimmed_starts, seconds) - 1)
+        return self.original_starts[index] + (seconds - self.trimmed_starts[index])
+
+    def to_dict(self):
+        return {'spans': [[trimmed, original] for trimmed, original in zip(self.trimmed_starts, self.original_starts)]}
+
+    @classmethod
+    def from_dict(cls, data):
+        spans = data['spans']
+        return cls((span[0] for span in spans), (span[1] for span in spans))
+
+
+def frame_energies(source, frame):
+    """Energy in dB of each whole VAD frame of an open 16-bit mono wave file.
+
+    The file is read VAD_CHUNK_SECONDS at a time, so memory does not grow with its length.
+    """
+    chunk = max(1, int(source.getframerate() * VAD_CHUNK_SECONDS) // frame) * frame
+    sums = []
+    while True:
+        samples = np.frombuffer(source.readframes(chunk), dtype='<i2')
+        count = len(samples) // frame
+        if count:
+            frames = samples[:count * frame].reshape(count, frame).astype(np.int64)
+            sums.append(np.sum(frames * frames, axis=1))
+        if len(samples) < chunk:
+            break
+    if not sums:
+        return np.zeros(0)
+    return 10 * np.log10(np.concatenate(sums) / frame + 1e-10)
+
+
+def speech_regions(energy_db, frame, total_samples):
+    """Return (starts, ends) sample indices of the speech regions, given per-frame energies."""
+    if len(energy_db) == 0:
+        return np.array([0]), np.array([total_samples])
+
+    speech = energy_db > np.percentile(energy_db, 10) + VAD_THRESHOLD_DB
+
+    # Pad every speech frame so word onsets and trailing consonants are kept
+    padding = int(round(VAD_PADDING * 1000 / VAD_FRAME_MS))
+    speech = np.convolve(speech.astype(np.int32), np.ones(2 * padding + 1, dtype=np.int32), mode='same') > 0
+
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], speech.astype(np.int8), [0]))))
+    starts, ends = edges[::2], edges[1::2]
+    if len(starts) == 0:
+        return np.array([0]), np.array([total_samples])
+
+    # Short pauses stay in place; only gaps of at least VAD_MIN_SILENCE split regions
+    long_gaps = (starts[1:] - ends[:-1]) * VAD_FRAME_MS / 1000 >= VAD_MIN_SILENCE
+    starts = starts[np.concatenate(([True], long_gaps))]
+    ends = ends[np.concatenate((long_gaps, [True]))]
+    return starts * frame, np.minimum(ends * frame, total_samples)
+
+
+def trim_silence(path):
+    """Rewrite a 16-bit mono WAV file without its long silences.
+
+    Returns the TimeMap of the rewritten file, or None when it was left unchanged.
+    """
+    trimmed_path = f'{path}.trimmed'
+    with wave.open(path, 'rb') as source:
+        params = source.getparams()
+        if params.sampwidth != 2 or params.nchannels != 1:
+            return None
+        frame = int(params.framerate * VAD_FRAME_MS / 1000)
+        starts, ends = speech_regions(frame_energies(source, frame), frame, params.nframes)
+        kept = int(np.sum(ends - starts))
+        if params.nframes == 0 or kept > params.nframes * (1 - VAD_MIN_SAVING):
+            return None
+
+        # Kept spans are copied chunk by chunk into a new file that then replaces the original
+        chunk = int(params.framerate * VAD_CHUNK_SECONDS)
+        try:
+            with wave.open(trimmed_path, 'wb') as target:
+                target.setparams(params)
+                for start, end in zip(starts, ends):
+                    source.setpos(int(start))
+                    remaining = int(end - start)
+                    while remaining > 0:
+                        data = source.readframes(min(chunk, remaining))
+                        if not data:
+                            break
+                        target.writeframes(data)
+                        remaining -= len(data) // params.sampwidth
+        except BaseException:
+            if os.path.exists(trimmed_path):
+                os.remove(trimmed_path)
+            raise
+    os.replace(trimmed_path, path)
+
+    trimmed_starts = np.concatenate(([0], np.cumsum(ends - starts)[:-1]))
+    return TimeMap(
+        (float(start) / params.framerate for start in trimmed_starts),
+        (float(start) / params.framerate for start in starts)
+    )
@@ -1,24 +1,42 @@
 # youtube_utils.py
 
 import os
+import sys
+import time
 import uuid
+import tempfile
+import subprocess
 import traceback
 from flask import current_app
 import yt_dlp
-from google.cloud import storage, speech
+from google.cloud import speech
 from datetime import timedelta
 import re
 from urllib.parse import urlparse, parse_qs
 import json
 import requests
 from urllib3.exceptions import InsecureRequestWarning
-from youtube_transcript_api import YouTubeTranscriptApi
+from youtube_transcript_api import YouTubeTranscriptApi, TranscriptsDisabled, NoTranscriptFound
 from youtube_transcript_api.formatters import TextFormatter
 from utils import load_api_key
+from clients import get_bucket, get_speech_client, get_http_session
+from cache import get_cache
+from transcript_store import TranscriptStore
+from audio_store import audio_blob_name, find_stored_audio, time_map_blob_name, record_audio_blob, touch_audio_blob
+from metrics import Gauge, timed, record_stage, downloads_in_flight, directory_bytes
+from admission import admit
+from proxy_pool import get_proxy_pool
+from ytdlp_pool import YTDLP_PROCESSES, get_ytdlp_pool
+from vad import VAD_ENABLED, TimeMap, trim_silence
+from google.api_core.exceptions import NotFound
+from google.api_core import operation as gapic_operation
 
 # Disable SSL verification warnings
 requests.packages.urllib3.disable_warnings(category=InsecureRequestWarning)
 
+# Seconds each youtube-transcript-api HTTP request may take before it fails
+TRANSCRIPT_REQUEST_TIMEOUT = float(os.environ.get('TRANSCRIPT_REQUEST_TIMEOUT', 10))
+
 # Monkey patch the session to disable SSL verification
 old_session = requests.Session
 class NoVerifySession(old_session):
@@ -26,6 +44,11 @@ class NoVerifySession(old_session):
         super().__init__()
         self.verify = False
 
+    def request(self, method, url, **kwargs):
+        # youtube-transcript-api creates its own sessions and never passes a timeout
+        kwargs.setdefault('timeout', TRANSCRIPT_REQUEST_TIMEOUT)
+        return super().request(method, url, **kwargs)
+
 requests.Session = NoVerifySession
 class CustomTextFormatter(TextFormatter):
     def format_transcript(self, transcript):
@@ -42,13 +65,110 @@ class CustomTextFormatter(TextFormatter):
         return "\n".join(formatted_lines)
 
 BUCKET_NAME = 'keith_speech_to_text'
-storage_client = storage.Client()
-bucket = storage_client.bucket(BUCKET_NAME)
 
-def download_audio(url):
-    """从给定的 URL 下载音频并将其上传到 Google Cloud Storage。"""
+# Local staging directory for downloads and transcodes
+AUDIO_TMP_DIR = os.environ.get('AUDIO_TMP_DIR', '/app/tmp')
+
+tmp_dir_bytes = Gauge('tmp_dir_bytes', 'Bytes staged in AUDIO_TMP_DIR', function=lambda: directory_bytes(AUDIO_TMP_DIR))
+
+# Seconds between progress polls of a long-running recognize operation
+RECOGNITION_POLL_INTERVAL = 5
+
+# Pipe yt-dlp -> ffmpeg -> GCS resumable upload instead of staging files in /app/tmp
+AUDIO_STREAMING = os.environ.get('AUDIO_STREAMING', '0') == '1'
+# Resumable upload chunk size; GCS requires a multiple of 256 KiB
+STREAM_CHUNK_SIZE = int(os.environ.get('STREAM_CHUNK_SIZE', 8 * 1024 * 1024))
+STREAM_READ_SIZE = 1024 * 1024
+
+# Speech encoding for each uploaded audio extension; WAV and FLAC headers carry the sample rate
+AUDIO_ENCODINGS = {
+    'wav': speech.RecognitionConfig.AudioEncoding.LINEAR16,
+    'flac': speech.RecognitionConfig.AudioEncoding.FLAC,
+    'opus': speech.RecognitionConfig.AudioEncoding.OGG_OPUS,
+}
+# Encodings whose sample rate has to be given in the recognition config; Opus always decodes at 48 kHz
+AUDIO_SAMPLE_RATES = {
+    'opus': 48000,
+}
+
+# Uploaded encoding for downloaded audio: "auto" passes YouTube's Opus stream through with a
+# remux and transcodes anything else to FLAC; "flac" or "wav" always transcode
+AUDIO_CODEC = os.environ.get('AUDIO_CODEC', 'auto')
+# Lowest Opus bitrate (kbit/s) worth recognizing; the smallest stream above it is downloaded
+AUDIO_MIN_BITRATE = int(os.environ.get('AUDIO_MIN_BITRATE', 40))
+
+def recognition_encoding(gcs_uri):
+    """根据 GCS 对象的扩展名选择 Speech-to-Text 的编码。"""
+    extension = gcs_uri.rsplit('.', 1)[-1].lower()
+    return AUDIO_ENCODINGS.get(extension, speech.RecognitionConfig.AudioEncoding.LINEAR16)
+
+def recognition_sample_rate(gcs_uri):
+    """需要在识别配置中声明的采样率；文件头已包含采样率时返回 None。"""
+    return AUDIO_SAMPLE_RATES.get(gcs_uri.rsplit('.', 1)[-1].lower())
+
+def recognition_channel_count(gcs_uri):
+    """从对象名（audio/<id>-<rate>hz-<n>ch.<ext>）中读取声道数，名称中没有时返回 None。"""
+    match = re.search(r'-(\d+)ch\.\w+$', gcs_uri)
+    return int(match.group(1)) if match else None
+
+def audio_format():
+    """yt-dlp 的格式选择：AUDIO_CODEC 为 auto 时优先选择满足码率要求的最小 Opus 音频流。"""
+    if AUDIO_CODEC == 'auto' and not VAD_ENABLED:
+        return f'worstaudio[acodec=opus][abr>={AUDIO_MIN_BITRATE}]/bestaudio[acodec=opus]/bestaudio/best'
+    return 'bestaudio/best'
+
+def choose_audio_codec(info):
+    """根据 yt-dlp 选中的格式决定上传的编码。"""
+    if VAD_ENABLED:
+        # Silence trimming works on PCM samples
+        return 'wav'
+    if AUDIO_CODEC != 'auto':
+        return AUDIO_CODEC
+    return 'opus' if (info.get('acodec') or '').startswith('opus') else 'flac'
+
+def download_audio(url, cancel_event=None, on_stage=None, streaming=None):
+    """从给定的 URL 下载音频并将其上传到 Google Cloud Storage。
+
+    cancel_event 被设置时（例如推测性下载期间找到了官方字幕）会中止下载。
+    on_stage(stage, progress) 用于报告当前阶段和进度百分比。
+    streaming 为 True 时（默认取 AUDIO_STREAMING）不经过本地临时文件。
+    """
+    if streaming is None:
+        streaming = AUDIO_STREAMING
+
+    # Audio is stored under a name derived from the video, so a previous download in any encoding can be reused
+    video_id = get_video_id(url)
+    bucket = get_bucket(BUCKET_NAME)
+    stored = find_stored_audio(bucket, video_id, AUDIO_ENCODINGS) if video_id else None
+    if stored is not None:
+        current_app.logger.info(f"Reusing stored audio: {stored.name}")
+        touch_audio_blob(stored.name)
+        with timed('sign'):
+            return stored.generate_signed_url(
+                version="v4",
+                expiration=3600,
+                method="GET"
+            )
+
+    downloads_in_flight.inc()
+    try:
+        if streaming:
+            blob = bucket.blob(audio_blob_name(video_id, 'flac') if video_id else f'audio/{uuid.uuid4()}.flac')
+            # Download, transcode and upload all run for the whole stream
+            with admit('ytdlp', 'ffmpeg', 'gcs'):
+                signed_url = stream_audio_to_gcs(url, blob, cancel_event=cancel_event, on_stage=on_stage)
+            if video_id:
+                record_audio_blob(bucket, blob, video_id, 'flac')
+            return signed_url
+        return _download_audio_file(url, bucket, video_id, cancel_event, on_stage)
+    finally:
+        downloads_in_flight.dec()
+
+def _download_audio_file(url, bucket, video_id, cancel_event, on_stage):
+    """经本地临时文件下载音频，按选中的格式直接封装或转码后上传。"""
+
     # Create a temporary local path for initial download
-    temp_file = f'/app/tmp/{uuid.uuid4()}-192'
+    temp_file = os.path.join(AUDIO_TMP_DIR, f'{uuid.uuid4()}-192')
     
     current_app.logger.info(f"Attempting to download: {url}")
     current_app.logger.info(f"Temp file path: {temp_file}")
@@ -56,56 +176,129 @@ def download_audio(url):
     # Ensure directory exists
     os.makedirs(os.path.dirname(temp_file), exist_ok=True)
     
-    ydl_opts = {
-        'format': 'bestaudio/best',
-        'outtmpl': temp_file,
-        'postprocessors': [{
-            'key': 'FFmpegExtractAudio',
-            'preferredcodec': 'wav',
-            'preferredquality': '64',
-        }],
-        'postprocessor_args': [
-            '-ar', '16000',
-            '-ac', '1'    
-        ],
-        'verbose': True  # Add verbose output for debugging
-    }
+    # Download and transcode happen inside one extract_info call, so time them from the hooks
+    download_started = time.perf_counter()
+
+    def check_cancelled(progress):
+        if cancel_event is not None and cancel_event.is_set():
+            raise yt_dlp.utils.DownloadCancelled('Audio download cancelled')
+        if progress and progress.get('status') == 'finished':
+            record_stage('download', time.perf_counter() - download_started)
+        if on_stage is not None and progress and progress.get('status') == 'downloading':
+            total = progress.get('total_bytes') or progress.get('total_bytes_estimate')
+            if total:
+                on_stage('downloading', round(100 * progress.get('downloaded_bytes', 0) / total, 1))
+
+    transcode_started = {}
+
+    def time_transcode(progress):
+        if progress.get('postprocessor') != 'ExtractAudio':
+            return
+        if progress.get('status') == 'started':
+            transcode_started['at'] = time.perf_counter()
+        elif progress.get('status') == 'finished' and 'at' in transcode_started:
+            record_stage('transcode', time.perf_counter() - transcode_started.pop('at'))
 
+    codec = None
     try:
+        # Resolve the format first: the postprocessor depends on which audio stream was picked
+        with admit('ytdlp'):
+            if YTDLP_PROCESSES:
+                info_dict = get_ytdlp_pool().extract_info(url, audio_format())
+            else:
+                with yt_dlp.YoutubeDL({'format': audio_format(), 'quiet': True}) as ydl:
+                    info_dict = ydl.extract_info(url, download=False)
+        codec = choose_audio_codec(info_dict)
+        current_app.logger.info(f"Selected format {info_dict.get('format_id')} ({info_dict.get('acodec')}), uploading as {codec}")
+
+        if codec == 'opus':
+            # Same codec as the source: FFmpegExtractAudio only remuxes WebM into Ogg
+            sample_rate, channels = AUDIO_SAMPLE_RATES['opus'], info_dict.get('audio_channels') or 2
+            postprocessor_args = []
+        else:
+            sample_rate, channels = 16000, 1
+            postprocessor_args = ['-ar', '16000', '-ac', '1']
+        # The channel count is part of the name so recognition_config can declare it
+        blob_name = audio_blob_name(video_id or uuid.uuid4(), codec, sample_rate, channels)
+        blob = bucket.blob(blob_name)
+
+        ydl_opts = {
+            'format': audio_format(),
+            'outtmpl': temp_file,
+            'postprocessors': [{
+                'key': 'FFmpegExtractAudio',
+                'preferredcodec': codec,
+                'preferredquality': '64',
+            }],
+            'postprocessor_args': postprocessor_args,
+            'progress_hooks': [check_cancelled],
+            'postprocessor_hooks': [time_transcode],
+            'verbose': True  # Add verbose output for debugging
+        }
+
         # Download audio using yt-dlp
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            current_app.logger.info("Starting download with yt-dlp")
-            info_dict = ydl.extract_info(url, download=True)
-            
-            # Check for both the original temp file and potential .wav extension
-            actual_temp_file = temp_file
-            if not os.path.exists(actual_temp_file):
-                # Try with .wav extension if original doesn't exist
-                wav_temp_file = f"{temp_file}.wav"
-                if os.path.exists(wav_temp_file):
-                    actual_temp_file = wav_temp_file
-                else:
-                    raise FileNotFoundError(f"Downloaded file not found at {temp_file} or {wav_temp_file}")
-            
-            current_app.logger.info(f"File downloaded successfully. Size: {os.path.getsize(actual_temp_file)}")
-            
-            # Use the actual_temp_file for upload
-            blob_name = f'audio/{uuid.uuid4()}.wav'
-            blob = bucket.blob(blob_name)
-            current_app.logger.info(f"Uploading to GCS: {blob_name}")
-            
+        current_app.logger.info("Starting download with yt-dlp")
+        if on_stage is not None:
+            on_stage('downloading', 0)
+        # yt-dlp runs ffmpeg itself as a postprocessor, so both are held for the download
+        with admit('ytdlp', 'ffmpeg'):
+            if YTDLP_PROCESSES:
+                # Download and transcode run in a warm worker process; the hooks above still run here
+                get_ytdlp_pool().download(info_dict, ydl_opts)
+            else:
+                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                    ydl.process_ie_result(info_dict, download=True)
+        
+        # Check for both the original temp file and potential extension added by the postprocessor
+        actual_temp_file = temp_file
+        if not os.path.exists(actual_temp_file):
+            # Try with the codec's extension if original doesn't exist
+            codec_temp_file = f"{temp_file}.{codec}"
+            if os.path.exists(codec_temp_file):
+                actual_temp_file = codec_temp_file
+            else:
+                raise FileNotFoundError(f"Downloaded file not found at {temp_file} or {codec_temp_file}")
+        
+        current_app.logger.info(f"File downloaded successfully. Size: {os.path.getsize(actual_temp_file)}")
+        check_cancelled(None)
+
+        if codec == 'wav' and VAD_ENABLED:
+            if on_stage is not None:
+                on_stage('trimming', None)
+            with timed('vad'):
+                time_map = trim_silence(actual_temp_file)
+            if time_map is not None:
+                current_app.logger.info(f"Trimmed silence, size now {os.path.getsize(actual_temp_file)}")
+                # Written before the audio so stored audio never lacks its time map
+                bucket.blob(time_map_blob_name(blob_name)).upload_from_string(
+                    json.dumps(time_map.to_dict()), content_type='application/json'
+                )
+        
+        # Use the actual_temp_file for upload
+        current_app.logger.info(f"Uploading to GCS: {blob_name}")
+        if on_stage is not None:
+            on_stage('uploading', None)
+        
+        with admit('gcs'), timed('upload'):
             blob.upload_from_filename(actual_temp_file)
-            
-            # Generate signed URL
+        if video_id:
+            record_audio_blob(bucket, blob, video_id, codec, sample_rate, channels)
+        
+        # Generate signed URL
+        with timed('sign'):
             url = blob.generate_signed_url(
                 version="v4",
                 expiration=3600,
                 method="GET"
             )
-            
-            current_app.logger.info("Process completed successfully")
-            return url
-            
+        
+        current_app.logger.info("Process completed successfully")
+        return url
+        
+    except yt_dlp.utils.DownloadCancelled:
+        current_app.logger.info(f"Download cancelled: {url}")
+        raise
+
     except Exception as e:
         current_app.logger.error(f"Error in download_audio: {str(e)}")
         current_app.logger.error(traceback.format_exc())
@@ -113,7 +306,7 @@ def download_audio(url):
         
     finally:
         # Clean up temp files
-        for file_path in [temp_file, f"{temp_file}.wav"]:
+        for file_path in [temp_file] + ([f"{temp_file}.{codec}"] if codec else []):
             if os.path.exists(file_path):
                 try:
                     os.remove(file_path)
@@ -121,15 +314,102 @@ def download_audio(url):
                 except Exception as e:
                     current_app.logger.error(f"Error cleaning up {file_path}: {str(e)}")
 
-def transcribe_audio_with_diarization(gcs_uri):
-    """对音频进行转录，带有说话者区分和时间戳。"""
-    
-    current_app.logger.info(f"Starting transcription for: {gcs_uri}")
-    
-    client = speech.SpeechClient()
-    
-    config = speech.RecognitionConfig(
-        encoding=speech.RecognitionConfig.AudioEncoding.LINEAR16,
+def stream_audio_to_gcs(url, blob, cancel_event=None, on_stage=None):
+    """把 yt-dlp 的输出经 ffmpeg 转码为 16 kHz 单声道 FLAC，边下载边分块上传到 blob。
+
+    磁盘和内存占用与视频长度无关，上传与下载同时进行。
+    """
+    blob_name = blob.name
+    blob.chunk_size = STREAM_CHUNK_SIZE
+
+    current_app.logger.info(f"Streaming {url} to GCS: {blob_name}")
+    if on_stage is not None:
+        on_stage('downloading', None)
+
+    # stderr goes to anonymous temp files so a chatty process can never block on a full pipe
+    ytdlp_log = tempfile.TemporaryFile()
+    ffmpeg_log = tempfile.TemporaryFile()
+    ytdlp = subprocess.Popen(
+        [sys.executable, '-m', 'yt_dlp', '-f', 'bestaudio/best', '--quiet', '--no-part', '-o', '-', url],
+        stdout=subprocess.PIPE, stderr=ytdlp_log
+    )
+    ffmpeg = subprocess.Popen(
+        ['ffmpeg', '-loglevel', 'error', '-i', 'pipe:0', '-vn', '-ar', '16000', '-ac', '1', '-f', 'flac', 'pipe:1'],
+        stdin=ytdlp.stdout, stdout=subprocess.PIPE, stderr=ffmpeg_log
+    )
+    ytdlp.stdout.close()  # Let yt-dlp see a broken pipe if ffmpeg exits early
+
+    uploaded = 0
+    stream_started = time.perf_counter()
+    try:
+        with blob.open('wb', content_type='audio/flac') as writer:
+            while True:
+                if cancel_event is not None and cancel_event.is_set():
+                    raise yt_dlp.utils.DownloadCancelled('Audio download cancelled')
+                chunk = ffmpeg.stdout.read(STREAM_READ_SIZE)
+                if not chunk:
+                    break
+                writer.write(chunk)
+                uploaded += len(chunk)
+                if on_stage is not None:
+                    on_stage('uploading', None)
+
+            # Check the exit codes before the writer finalizes the upload
+            if ytdlp.wait() != 0 or ffmpeg.wait() != 0:
+                ytdlp_log.seek(0)
+                ffmpeg_log.seek(0)
+                raise RuntimeError(
+                    f"Streaming failed (yt-dlp {ytdlp.returncode}, ffmpeg {ffmpeg.returncode}): "
+                    f"{ytdlp_log.read().decode(errors='replace')} {ffmpeg_log.read().decode(errors='replace')}"
+                )
+
+        # Download, transcode and upload overlap here, so they are timed as one stage
+        record_stage('stream', time.perf_counter() - stream_started)
+        current_app.logger.info(f"Streamed {uploaded} bytes to {blob_name}")
+        with timed('sign'):
+            url = blob.generate_signed_url(
+                version="v4",
+                expiration=3600,
+                method="GET"
+            )
+        current_app.logger.info("Process completed successfully")
+        return url
+
+    except Exception as e:
+        if isinstance(e, yt_dlp.utils.DownloadCancelled):
+            current_app.logger.info(f"Download cancelled: {url}")
+        else:
+            current_app.logger.error(f"Error in stream_audio_to_gcs: {str(e)}")
+            current_app.logger.error(traceback.format_exc())
+        # The writer finalizes whatever was written on exit, so drop the partial object
+        try:
+            blob.delete()
+        except Exception:
+            pass
+        raise
+
+    finally:
+        for process in (ytdlp, ffmpeg):
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+        ffmpeg.stdout.close()
+        ytdlp_log.close()
+        ffmpeg_log.close()
+
+def recognition_config(gcs_uri):
+    """带说话者区分和词级时间戳的识别配置。"""
+    # Only set for encodings without a header that carries it
+    sample_rate = recognition_sample_rate(gcs_uri)
+    extra = {'sample_rate_hertz': sample_rate} if sample_rate else {}
+    # Passed-through Opus keeps the source's stereo; without the count Speech decodes it as mono.
+    # Only the first channel is recognized, which carries the same speech.
+    channels = recognition_channel_count(gcs_uri)
+    if channels and channels > 1:
+        extra['audio_channel_count'] = channels
+    return speech.RecognitionConfig(
+        encoding=recognition_encoding(gcs_uri),
+        **extra,
         enable_automatic_punctuation=True,
         enable_word_time_offsets=True,
         enable_automatic_language_detection=True,
@@ -139,20 +419,76 @@ def transcribe_audio_with_diarization(gcs_uri):
             max_speaker_count=2
         )
     )
+
+def wait_for_recognition(operation, on_stage=None, timeout=600):
+    """等待长时间识别操作完成，可选地报告识别进度。"""
+    if on_stage is not None:
+        # Poll instead of blocking so callers can report recognition progress
+        deadline = time.monotonic() + timeout
+        while not operation.done() and time.monotonic() < deadline:
+            progress = operation.metadata.progress_percent if operation.metadata else None
+            on_stage('recognizing', progress)
+            time.sleep(RECOGNITION_POLL_INTERVAL)
+        # The polling above already used part of the budget
+        return operation.result(timeout=max(1, deadline - time.monotonic()))
+    return operation.result(timeout=timeout)
+
+def resume_recognition(operation_name):
+    """按名称重新连接到已经存在的长时间识别操作。"""
+    operations_client = get_speech_client().transport.operations_client
+    return gapic_operation.from_gapic(
+        operations_client.get_operation(operation_name),
+        operations_client,
+        speech.LongRunningRecognizeResponse,
+        metadata_type=speech.LongRunningRecognizeMetadata
+    )
+
+def transcribe_audio_with_diarization(gcs_uri, on_stage=None, operation_name=None, on_operation=None):
+    """对音频进行转录，带有说话者区分和时间戳。
+
+    传入 operation_name 时继续等待该识别操作而不是重新提交；
+    on_operation(name) 在新操作提交后被调用，用于保存检查点。
+    """
     
-    audio = speech.RecognitionAudio(uri=gcs_uri)
+    current_app.logger.info(f"Starting transcription for: {gcs_uri}")
     
-    # Start long-running transcription
-    operation = client.long_running_recognize(
-        config=config,
-        audio=audio
-    )
+    client = get_speech_client()
+    
+    config = recognition_config(gcs_uri)
+    
+    audio = speech.RecognitionAudio(uri=gcs_uri)
     
-    current_app.logger.info("Waiting for transcription to complete...")
-    response = operation.result(timeout=600)  # 10 minute timeout
+    time_map = load_time_map(gcs_uri)
+    # Offsets in trimmed audio are shifted back onto the original video's timeline
+    to_original = time_map.to_original if time_map else (lambda seconds: seconds)
+
+    with admit('speech'), timed('recognize'):
+        operation = None
+        if operation_name:
+            try:
+                operation = resume_recognition(operation_name)
+                current_app.logger.info(f"Reattached to recognition operation {operation_name}")
+            except Exception as e:
+                current_app.logger.warning(f"Cannot resume operation {operation_name}, starting again: {str(e)}")
+        if operation is None:
+            # Start long-running transcription
+            operation = client.long_running_recognize(
+                config=config,
+                audio=audio
+            )
+            if on_operation is not None:
+                on_operation(operation.operation.name)
+        
+        current_app.logger.info("Waiting for transcription to complete...")
+        response = wait_for_recognition(operation, on_stage)  # 10 minute timeout
+    if on_stage is not None:
+        on_stage('formatting', None)
     
     # Process results to combine words into sentences with speaker tags and timestamps
     transcript_lines = []
+    # Line- and word-level data are kept in columnar stores rather than per-word dicts
+    segments = []
+    words = []
     
     for result in response.results:
         transcript = result.alternatives[0].transcript
@@ -161,36 +497,56 @@ def transcribe_audio_with_diarization(gcs_uri):
             
         # Get the first word's details for the timestamp and speaker
         first_word = result.alternatives[0].words[0]
-        timestamp = f"[{format_timestamp(first_word.start_time.total_seconds())}]"
+        start_time = to_original(first_word.start_time.total_seconds())
+        timestamp = f"[{format_timestamp(start_time)}]"
         speaker_tag = first_word.speaker_tag
         
         # Add the line with timestamp and speaker tag
         transcript_lines.append(
             f"{timestamp} Speaker {speaker_tag}: {transcript}"
         )
-    
-    # Convert response.results to a serializable format
-    raw_results = []
-    for result in response.results:
-        raw_result = {
-            'alternatives': [{
-                'transcript': alt.transcript,
-                'confidence': alt.confidence,
-                'words': [{
-                    'word': word.word,
-                    'start_time': word.start_time.total_seconds(),
-                    'end_time': word.end_time.total_seconds(),
-                    'speaker_tag': word.speaker_tag
-                } for word in alt.words]
-            } for alt in result.alternatives]
-        }
-        raw_results.append(raw_result)
+        segments.append((
+            start_time,
+            to_original(result.alternatives[0].words[-1].end_time.total_seconds()),
+            speaker_tag,
+            transcript
+        ))
+        words.extend(
+            (to_original(word.start_time.total_seconds()), to_original(word.end_time.total_seconds()), word.speaker_tag, word.word)
+            for word in result.alternatives[0].words
+        )
 
     return {
         'formatted_transcript': "\n".join(transcript_lines),
-        'raw_transcript': raw_results
+        'segments': TranscriptStore.from_segments(segments),
+        'words': TranscriptStore.from_segments(words)
     }
 
+def load_time_map(gcs_uri):
+    """读取静音裁剪时保存的时间映射；音频未被裁剪时返回 None。"""
+    # Only the WAV download path trims silence
+    if not gcs_uri.endswith('.wav'):
+        return None
+    blob_name = gcs_uri.replace(f'gs://{BUCKET_NAME}/', '', 1)
+    try:
+        return TimeMap.from_dict(json.loads(get_bucket(BUCKET_NAME).blob(time_map_blob_name(blob_name)).download_as_text()))
+    except NotFound:
+        return None
+
+def gcs_uri_exists(gcs_uri):
+    """gs:// URI 指向的对象是否仍然存在（可能已被淘汰或被生命周期规则删除）。"""
+    blob_name = gcs_uri.replace(f'gs://{BUCKET_NAME}/', '', 1)
+    return get_bucket(BUCKET_NAME).blob(blob_name).exists()
+
+def sign_gcs_uri(gcs_uri, expiration=3600):
+    """为 gs:// URI 生成签名下载 URL。"""
+    blob_name = gcs_uri.replace(f'gs://{BUCKET_NAME}/', '', 1)
+    return get_bucket(BUCKET_NAME).blob(blob_name).generate_signed_url(
+        version="v4",
+        expiration=expiration,
+        method="GET"
+    )
+
 def format_timestamp(seconds):
     """将秒转换为 HH:MM:SS 格式。"""
     return str(timedelta(seconds=int(seconds)))
@@ -198,6 +554,7 @@ def format_timestamp(seconds):
 def test_gcs_connection():
     """通过列出 blob 和创建测试 blob 来测试与 Google Cloud Storage 的连接。"""
     try:
+        bucket = get_bucket(BUCKET_NAME)
         # List a few blobs to test connection
         blobs = list(bucket.list_blobs(max_results=1))
         
@@ -220,48 +577,110 @@ def test_gcs_connection():
             "traceback": traceback.format_exc()
         }
     
-def get_youtube_video_metadata(video_url):
-    """使用 YouTube Data API 获取视频元数据包括题、描述、缩略图、频道标题、发布时间、标签和是否包含转录。"""
-    # Parse the URL and extract the video ID from the query parameters
-    parsed_url = urlparse(video_url)
+def get_video_id(video_url):
+    """从 YouTube URL 的查询参数中提取视频 ID，无效时返回 None。"""
+    parsed_url = urlparse(video_url or '')
     video_id = parse_qs(parsed_url.query).get('v')
 
     if not video_id or not video_id[0]:
+        return None
+
+    return video_id[0]  # Get the first video ID from the list
+
+# videos.list accepts at most this many comma-separated IDs per call
+YOUTUBE_MAX_IDS_PER_REQUEST = 50
+
+def _parse_video_metadata(video_info):
+    """把 videos.list 返回的单个 item 转换为元数据字典。"""
+    title = video_info['snippet'].get('title', 'Unknown Title')
+    description = video_info['snippet'].get('description', 'No description available.')
+    thumbnails = video_info['snippet'].get('thumbnails', {})
+    channel_title = video_info['snippet'].get('channelTitle', 'Unknown Channel')
+    published_at = video_info['snippet'].get('publishedAt', 'Unknown Publish Date')
+    tags = video_info['snippet'].get('tags', [])
+
+    return {
+        'title': title,
+        'description': description,
+        'thumbnails': thumbnails,
+        'channel_title': channel_title,
+        'published_at': published_at,
+        'tags': tags,
+        'language': video_info['snippet'].get('defaultAudioLanguage', 'Unknown Language'),
+    }
+
+def get_youtube_videos_metadata(video_ids):
+    """批量获取多个视频的元数据，每次 API 调用最多 50 个 ID。
+
+    返回 {video_id: metadata}，失败的视频对应 {'error': ...}。
+    """
+    cache = get_cache()
+    results = {}
+    missing = []
+    for video_id in dict.fromkeys(video_ids):  # De-duplicate while keeping order
+        cached = cache.get('metadata', video_id)
+        if cached is not None:
+            results[video_id] = cached
+        else:
+            missing.append(video_id)
+
+    if not missing:
+        return results
+
+    api_key = load_api_key("youtube_api_key")
+    for i in range(0, len(missing), YOUTUBE_MAX_IDS_PER_REQUEST):
+        chunk = missing[i:i + YOUTUBE_MAX_IDS_PER_REQUEST]
+        url = f"https://www.googleapis.com/youtube/v3/videos?id={','.join(chunk)}&key={api_key}&part=snippet,contentDetails"
+        try:
+            with timed('metadata'):
+                response = get_http_session('youtube').get(url, timeout=30)
+                response.raise_for_status()  # Raise an error for bad responses
+                data = response.json()
+        except Exception as e:
+            current_app.logger.error(f"Error retrieving metadata for {len(chunk)} videos: {str(e)}")
+            for video_id in chunk:
+                results[video_id] = {'error': str(e)}
+            continue
+
+        for video_info in data.get('items', []):
+            metadata = _parse_video_metadata(video_info)
+            cache.set('metadata', video_info['id'], metadata)
+            results[video_info['id']] = metadata
+        for video_id in chunk:
+            results.setdefault(video_id, {'error': 'Video not found or no metadata available.'})
+
+    return results
+
+def get_youtube_video_metadata(video_url):
+    """使用 YouTube Data API 获取视频元数据包括题、描述、缩略图、频道标题、发布时间、标签和是否包含转录。"""
+    video_id = get_video_id(video_url)
+
+    if not video_id:
         return {'error': 'Invalid YouTube URL'}
 
-    video_id = video_id[0]  # Get the first video ID from the list
+    cache = get_cache()
+    cached = cache.get('metadata', video_id)
+    if cached is not None:
+        return cached
 
     # Load the API key
     api_key = load_api_key("youtube_api_key")
     url = f"https://www.googleapis.com/youtube/v3/videos?id={video_id}&key={api_key}&part=snippet,contentDetails"
 
     try:
-        response = requests.get(url)
-        response.raise_for_status()  # Raise an error for bad responses
-        data = response.json()
+        with timed('metadata'):
+            response = get_http_session('youtube').get(url, timeout=30)
+            response.raise_for_status()  # Raise an error for bad responses
+            data = response.json()
 
         if 'items' not in data or not data['items']:
             return {
                 'error': 'Video not found or no metadata available.'
             }
 
-        video_info = data['items'][0]
-        title = video_info['snippet'].get('title', 'Unknown Title')
-        description = video_info['snippet'].get('description', 'No description available.')
-        thumbnails = video_info['snippet'].get('thumbnails', {})
-        channel_title = video_info['snippet'].get('channelTitle', 'Unknown Channel')
-        published_at = video_info['snippet'].get('publishedAt', 'Unknown Publish Date')
-        tags = video_info['snippet'].get('tags', [])
-
-        return {
-            'title': title,
-            'description': description,
-            'thumbnails': thumbnails,
-            'channel_title': channel_title,
-            'published_at': published_at,
-            'tags': tags,
-            'language': video_info['snippet'].get('defaultAudioLanguage', 'Unknown Language'),
-        }
+        metadata = _parse_video_metadata(data['items'][0])
+        cache.set('metadata', video_id, metadata)
+        return metadata
     except Exception as e:
         current_app.logger.error(f"Error retrieving metadata for video URL {video_url}: {str(e)}")
         return {
@@ -270,33 +689,45 @@ def get_youtube_video_metadata(video_url):
 
 def get_youtube_transcript(video_url):
     """使用 youtube-transcript-api 获取 YouTube 视频的转录文本。"""
-    # Parse the URL and extract the video ID from the query parameters
-    parsed_url = urlparse(video_url)
-    video_id = parse_qs(parsed_url.query).get('v')
+    video_id = get_video_id(video_url)
 
-    if not video_id or not video_id[0]:
+    if not video_id:
         return {'error': 'Invalid YouTube URL'}
 
-    video_id = video_id[0]  # Get the first video ID from the list
-    
+    # Cached result may be a negative entry ("no native captions")
+    cache = get_cache()
+    cached = cache.get('captions', video_id)
+    if cached is not None:
+        # The cached entry also carries the columnar segments, which are served by /transcript
+        return {key: value for key, value in cached.items() if key != 'segments'}
+
     try:
-        # Only use proxy in non-local environments
-        if os.environ.get('FLASK_ENV') != 'development':
-            # proxy_url = load_api_key("proxy")[0]
-            proxy_url = "http://GS8dcJybiiSaxSg5XyhF3w:@smartproxy.crawlbase.com:8012"
-            proxies = {"http": proxy_url, "https": proxy_url}
-            transcript = YouTubeTranscriptApi.get_transcript(video_id, proxies=proxies)
-        else:
-            transcript = YouTubeTranscriptApi.get_transcript(video_id)
+        with timed('captions'):
+            # Only use proxy in non-local environments
+            if os.environ.get('FLASK_ENV') != 'development':
+                # A missing or disabled transcript is an answer, not a proxy failure
+                transcript = get_proxy_pool().call(
+                    lambda proxies: YouTubeTranscriptApi.get_transcript(video_id, proxies=proxies),
+                    definitive=(TranscriptsDisabled, NoTranscriptFound)
+                )
+            else:
+                transcript = YouTubeTranscriptApi.get_transcript(video_id)
 
         # Optionally format the transcript
         formatter = CustomTextFormatter()
         formatted_transcript = formatter.format_transcript(transcript)
 
-        return {
+        result = {
             'formatted_transcript': formatted_transcript,
             # 'raw_transcript': transcript
         }
+        cache.set('captions', video_id, {**result, 'segments': TranscriptStore.from_captions(transcript).to_dict()})
+        return result
+    except (TranscriptsDisabled, NoTranscriptFound) as e:
+        # The video has no usable captions: remember that so repeat requests go straight to audio
+        result = {'error': str(e)}
+        cache.set('captions', video_id, result, negative=True)
+        return result
     except Exception as e:
         return {
             'error': str(e),
@@ -0,0 +1,157 @@
+# ytdlp_pool.py
+
+import os
+import time
+import queue
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import yt_dlp
+
+# Long-lived processes that run yt-dlp extraction, download and ffmpeg postprocessing; 0 runs them in the web worker
+YTDLP_PROCESSES = int(os.environ.get('YTDLP_PROCESSES', 0))
+# yt-dlp's on-disk cache of YouTube player signature functions, shared by the worker processes
+YTDLP_CACHE_DIR = os.environ.get('YTDLP_CACHE_DIR', '/app/tmp/yt-dlp-cache')
+# Download progress is forwarded from a worker at most this often
+YTDLP_PROGRESS_INTERVAL = 0.5
+
+# Fields of the yt-dlp hook dicts that are forwarded to the hooks in the web worker
+PROGRESS_FIELDS = ('status', 'downloaded_bytes', 'total_bytes', 'total_bytes_estimate')
+POSTPROCESSOR_FIELDS = ('status', 'postprocessor')
+
+# Set in each worker process by _init_worker
+_extractor = None
+# Format selectors already built by this worker, by format spec
+_format_selectors = {}
+
+
+def _init_worker():
+    global _extractor
+    # Extractor instances, and the player JS and signature functions they fetch, stay cached on this object
+    _extractor = yt_dlp.YoutubeDL({'quiet': True, 'cachedir': YTDLP_CACHE_DIR})
+
+
+def _extract_info(url, format_spec):
+    # YoutubeDL compiles the format selector from params once, in __init__, so swap in the compiled selector
+    if format_spec not in _format_selectors:
+        _format_selectors[format_spec] = _extractor.build_format_selector(format_spec)
+    _extractor.params['format'] = format_spec
+    _extractor.format_selector = _format_selectors[format_spec]
+    info = _extractor.extract_info(url, download=False)
+    # Only plain data can be sent back to the web worker
+    return _extractor.sanitize_info(info)
+
+
+def _download(info, params, events, cancelled):
+    last_sent = [0.0]
+
+    def forward(kind, fields):
+        def hook(progress):
+            now = time.monotonic()
+            if progress.get('status') == 'downloading' and now - last_sent[0] < YTDLP_PROGRESS_INTERVAL:
+                return
+            last_sent[0] = now
+            if cancelled.is_set():
+                raise yt_dlp.utils.DownloadCancelled('Audio download cancelled')
+            events.put((kind, {field: progress.get(field) for field in fields}))
+        return hook
+
+    params = dict(
+        params,
+        quiet=True,
+        verbose=False,
+        cachedir=YTDLP_CACHE_DIR,
+        progress_hooks=[forward('progress_hooks', PROGRESS_FIELDS)],
+        postprocessor_hooks=[forward('postprocessor_hooks', POSTPROCESSOR_FIELDS)]
+    )
+    # The format was resolved by _extract_info, so nothing is extracted again here
+    with yt_dlp.YoutubeDL(params) as ydl:
+        ydl.process_ie_result(info, download=True)
+
+
+class YtdlpPool:
+    """Pre-forked worker processes that keep yt-dlp imported and its YouTube extractor warm.
+
+    Jobs are sent over the executor's call queue. Progress and postprocessor hooks given in the
+    download params still run in the calling thread, fed from events the worker sends back.
+    """
+
+    def __init__(self, processes=YTDLP_PROCESSES):
+        self.processes = processes
+        # Workers are forked from a single-threaded server process, never from a threaded web worker.
+        # Preloading __main__ there keeps each new worker from importing the app module again.
+        self._context = multiprocessing.get_context('forkserver')
+        self._context.set_forkserver_preload(['__main__', 'yt_dlp', __name__])
+        self._executor = self._new_executor()
+        self._manager = None
+        self._lock = threading.Lock()
+
+    def _new_executor(self):
+        return ProcessPoolExecutor(max_workers=self.processes, mp_context=self._context, initializer=_init_worker)
+
+    def _submit(self, fn, *args):
+        executor = self._executor
+        try:
+            return executor.submit(fn, *args)
+        except BrokenProcessPool:
+            # A worker died (e.g. killed for memory); start a fresh set of processes
+            with self._lock:
+                if self._executor is executor:
+                    self._executor = self._new_executor()
+            return self._executor.submit(fn, *args)
+
+    def _get_manager(self):
+        with self._lock:
+            if self._manager is None:
+                self._manager = self._context.Manager()
+            return self._manager
+
+    def extract_info(self, url, format_spec):
+        return self._submit(_extract_info, url, format_spec).result()
+
+    def download(self, info, params):
+        hooks = {
+            'progress_hooks': params.get('progress_hooks', []),
+            'postprocessor_hooks': params.get('postprocessor_hooks', [])
+        }
+        params = {key: value for key, value in params.items() if key not in hooks}
+        manager = self._get_manager()
+        events = manager.Queue()
+        cancelled = manager.Event()
+        future = self._submit(_download, info, params, events, cancelled)
+        try:
+            while True:
+                try:
+                    kind, progress = events.get(timeout=YTDLP_PROGRESS_INTERVAL)
+                except queue.Empty:
+                    if future.done() and events.empty():
+                        break
+                    continue
+                for hook in hooks[kind]:
+                    hook(progress)
+        except BaseException:
+            # A hook raised (e.g. the download was cancelled): stop the worker at its next event
+            cancelled.set()
+            future.exception()
+            raise
+        return future.result()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        if self._manager is not None:
+            self._manager.shutdown()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_ytdlp_pool():
+    """Return the process-wide yt-dlp worker pool, starting it on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = YtdlpPool()
+    return _pool